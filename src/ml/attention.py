@@ -2,6 +2,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from typing import Optional, Tuple
+from metrics import timed, observe_batch
 
 class MultiHeadAttention(nn.Module):
     def __init__(self, d_model: int, num_heads: int, dropout: float = 0.1):
@@ -135,12 +136,14 @@ class DesignStyleExtractor(nn.Module):
         """Extract features from layout information"""
         return self.layout_encoder(layout)
     
+    @timed('design_style_extractor_forward')
     def forward(
         self,
         colors: torch.Tensor,
         typography: torch.Tensor,
         layout: torch.Tensor
     ) -> torch.Tensor:
+        observe_batch('design_style_extractor_forward', colors.size(0))
         # Extract features from different style aspects
         color_features = self.extract_color_features(colors)
         typography_features = self.extract_typography_features(typography)
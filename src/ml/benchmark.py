@@ -0,0 +1,387 @@
+import argparse
+import atexit
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import torch
+from PIL import Image
+
+NODE_TYPES = ['FRAME', 'GROUP', 'RECTANGLE', 'TEXT', 'VECTOR', 'INSTANCE', 'ELLIPSE']
+
+# name -> (setup, default repeats); setup(args) returns the callable to time
+CASES: Dict[str, tuple] = {}
+
+
+def case(name: str, repeats: int = 20):
+    def register(setup: Callable[[argparse.Namespace], Callable[[], Any]]):
+        CASES[name] = (setup, repeats)
+        return setup
+    return register
+
+
+def _temp_dir(prefix: str) -> str:
+    path = tempfile.mkdtemp(prefix=prefix)
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+def make_figma_tree(num_nodes: int, max_depth: int, seed: int = 0) -> Dict[str, Any]:
+    """Random Figma document with `num_nodes` nodes nested at most `max_depth` deep"""
+    rng = random.Random(seed)
+    root = {'type': 'FRAME', 'name': 'root', 'x': 0, 'y': 0,
+            'width': 1440, 'height': 1024, 'children': []}
+    parents = [(root, 0)]
+    for i in range(num_nodes - 1):
+        parent, depth = rng.choice(parents)
+        node = {
+            'type': rng.choice(NODE_TYPES),
+            'name': f'node-{i}',
+            'x': rng.randint(0, 1400),
+            'y': rng.randint(0, 1000),
+            'width': rng.randint(8, 600),
+            'height': rng.randint(8, 400),
+            'fills': [{'type': 'SOLID', 'color': {
+                'r': rng.random(), 'g': rng.random(), 'b': rng.random(), 'a': 1.0
+            }}],
+            'children': [],
+        }
+        parent['children'].append(node)
+        if depth + 1 < max_depth:
+            parents.append((node, depth + 1))
+    return {'document': root}
+
+
+def make_design_image(width: int, height: int, seed: int = 0, fmt: str = 'PNG') -> bytes:
+    """Encoded image of flat colour blocks with light noise, like a UI export"""
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, size=(height // 64 + 1, width // 64 + 1, 3), dtype=np.uint8)
+    pixels = np.repeat(np.repeat(blocks, 64, axis=0), 64, axis=1)[:height, :width]
+    pixels = np.clip(pixels + rng.integers(0, 8, size=pixels.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def make_dense_boxes(num_boxes: int, seed: int = 0) -> torch.Tensor:
+    """(num_boxes, 4) xyxy boxes where most boxes sit inside a larger one"""
+    gen = torch.Generator().manual_seed(seed)
+    boxes = []
+    while len(boxes) < num_boxes:
+        x1, y1 = torch.randint(0, 1200, (2,), generator=gen).tolist()
+        w, h = torch.randint(100, 400, (2,), generator=gen).tolist()
+        boxes.append([x1, y1, x1 + w, y1 + h])
+        # Slightly inset children so containment and IoU > 0.8 both hold
+        for _ in range(3):
+            inset = torch.randint(1, 6, (1,), generator=gen).item()
+            boxes.append([x1 + inset, y1 + inset, x1 + w - inset, y1 + h - inset])
+    return torch.tensor(boxes[:num_boxes], dtype=torch.float32)
+
+
+@case('process_figma_node')
+def bench_process_figma_node(args):
+    from model import process_figma_node
+
+    tree = make_figma_tree(args.figma_nodes, args.figma_depth)['document']
+    return lambda: process_figma_node(tree)
+
+
+@case('build_hierarchy', repeats=3)
+def bench_build_hierarchy(args):
+    from component_detection import ComponentHierarchyAnalyzer
+
+    components = {'boxes': make_dense_boxes(args.boxes)}
+    return lambda: ComponentHierarchyAnalyzer.build_hierarchy(components)
+
+
+@case('multi_head_attention')
+def bench_multi_head_attention(args):
+    from attention import MultiHeadAttention
+
+    attention = MultiHeadAttention(d_model=512, num_heads=8).eval()
+    x = torch.randn(args.batch_size, 128, 512)
+
+    def run():
+        with torch.no_grad():
+            attention(x, x, x)
+    return run
+
+
+@case('design_style_extractor')
+def bench_design_style_extractor(args):
+    from attention import DesignStyleExtractor
+
+    extractor = DesignStyleExtractor().eval()
+    colors = torch.rand(args.batch_size, 3)
+    typography = torch.rand(args.batch_size, 10)
+    layout = torch.rand(args.batch_size, 6)
+
+    def run():
+        with torch.no_grad():
+            extractor(colors, typography, layout)
+    return run
+
+
+def _design_to_code_batch(batch_size: int, seq_len: int = 32, vocab_size: int = 1000):
+    return {
+        'image': torch.randn(batch_size, 3, 224, 224),
+        'html_tokens': torch.randint(0, vocab_size, (batch_size, seq_len)),
+        'css_tokens': torch.randint(0, vocab_size, (batch_size, seq_len)),
+    }
+
+
+@case('design_to_code_forward', repeats=5)
+def bench_design_to_code_forward(args):
+    from model import DesignToCode
+
+    model = DesignToCode(html_vocab_size=1000, css_vocab_size=1000, pretrained=False).eval()
+    batch = _design_to_code_batch(args.batch_size)
+
+    def run():
+        with torch.no_grad():
+            model(batch['image'], batch['html_tokens'], batch['css_tokens'])
+    return run
+
+
+@case('train_model_step', repeats=3)
+def bench_train_model_step(args):
+    from model import DesignToCode
+    from train import train_step
+    from train_pipeline import BatchPrefetcher
+
+    model = DesignToCode(html_vocab_size=1000, css_vocab_size=1000, pretrained=False).train()
+    criterion = torch.nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    loader = [_design_to_code_batch(min(args.batch_size, 4))]
+    device = torch.device('cpu')
+
+    def run():
+        # One batch through the same prefetch and step path as train_model
+        for batch in BatchPrefetcher(loader, device):
+            train_step(model, batch, criterion, optimizer)
+    return run
+
+
+_client = None
+
+
+def _service_client():
+    global _client
+    if _client is None:
+        # service.py keeps its index and job queue on disk; keep them out of the tree
+        state_dir = _temp_dir('bench-service-')
+        os.environ['DESIGN_INDEX_DIR'] = os.path.join(state_dir, 'design_index')
+        os.environ['JOB_DB_PATH'] = os.path.join(state_dir, 'jobs.sqlite3')
+        import logging
+        from fastapi.testclient import TestClient
+        import service
+
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        _client = TestClient(service.app)
+        # Entering the client runs the startup hooks, which start the job workers
+        _client.__enter__()
+        atexit.register(_client.__exit__, None, None, None)
+    return _client
+
+
+@case('service_convert')
+def bench_service_convert(args):
+    client = _service_client()
+    design = make_figma_tree(args.figma_nodes, args.figma_depth)
+    counter = iter(range(sys.maxsize))
+
+    def run():
+        # A distinct payload per call so coalescing and lookup caches miss
+        response = client.post('/convert', json={
+            'design_data': design,
+            'settings': {'similarity_threshold': 1.1, 'run': next(counter)}
+        })
+        response.raise_for_status()
+    return run
+
+
+@case('service_process_image', repeats=10)
+def bench_service_process_image(args):
+    client = _service_client()
+    width, height = args.image_size
+    image = make_design_image(width, height)
+
+    def run():
+        response = client.post(
+            '/process-image',
+            files={'file': ('design.png', image, 'image/png')}
+        )
+        response.raise_for_status()
+    return run
+
+
+@case('service_jobs')
+def bench_service_jobs(args):
+    client = _service_client()
+    design = make_figma_tree(args.figma_nodes, args.figma_depth)
+    counter = iter(range(sys.maxsize))
+
+    def run():
+        # Submit, poll until a worker has finished it, then fetch the result
+        response = client.post('/jobs', json={
+            'design_data': design,
+            'settings': {'run': next(counter)}
+        })
+        response.raise_for_status()
+        job_id = response.json()['id']
+        while client.get(f'/jobs/{job_id}').json()['status'] not in ('succeeded', 'failed'):
+            time.sleep(0.001)
+        client.get(f'/jobs/{job_id}/result').raise_for_status()
+    return run
+
+
+@case('service_metrics')
+def bench_service_metrics(args):
+    client = _service_client()
+    # Scrape once the other service cases have populated the histograms
+    return lambda: client.get('/metrics').raise_for_status()
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(args) -> Dict[str, Any]:
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results = {}
+    for name, (setup, default_repeats) in CASES.items():
+        if args.filter and not any(f in name for f in args.filter):
+            continue
+        repeats = args.repeats or default_repeats
+        fn = setup(args)
+        for _ in range(args.warmup):
+            fn()
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        results[name] = {
+            'median_s': statistics.median(timings),
+            'mean_s': statistics.fmean(timings),
+            'min_s': min(timings),
+            'stdev_s': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            'repeats': repeats,
+        }
+        print(f"{name:<28} median {results[name]['median_s'] * 1000:10.3f} ms "
+              f"(min {results[name]['min_s'] * 1000:.3f}, n={repeats})")
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'threads': torch.get_num_threads(),
+            'params': {
+                'seed': args.seed,
+                'figma_nodes': args.figma_nodes,
+                'figma_depth': args.figma_depth,
+                'boxes': args.boxes,
+                'batch_size': args.batch_size,
+                'image_size': list(args.image_size),
+            },
+        },
+        'results': results,
+    }
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """Print a comparison table and return the names of regressed benchmarks"""
+    if baseline['meta']['params'] != current['meta']['params']:
+        print("warning: runs used different fixture parameters")
+
+    regressions = []
+    print(f"{'benchmark':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            print(f"{name:<28}{'-':>12}{result['median_s'] * 1000:>10.3f}ms{'new':>10}")
+            continue
+        before = baseline['results'][name]['median_s']
+        after = result['median_s']
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<28}{before * 1000:>10.3f}ms{after * 1000:>10.3f}ms{change:>+10.1%}{flag}")
+    return regressions
+
+
+def _image_size(value: str):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ML modules')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Run benchmarks and write JSON results')
+    run.add_argument('--output', type=str, default='benchmark.json', help='Results file')
+    run.add_argument('--filter', type=str, nargs='*', help='Only run benchmarks containing one of these')
+    run.add_argument('--repeats', type=int, default=0, help='Override the per-benchmark repeat count')
+    run.add_argument('--warmup', type=int, default=1, help='Untimed runs before measuring')
+    run.add_argument('--threads', type=int, default=0, help='torch intra-op threads (0 keeps the default)')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--figma-nodes', type=int, default=2000, help='Nodes in the synthetic Figma tree')
+    run.add_argument('--figma-depth', type=int, default=8, help='Maximum depth of the synthetic Figma tree')
+    run.add_argument('--boxes', type=int, default=100, help='Boxes passed to build_hierarchy')
+    run.add_argument('--batch-size', type=int, default=8)
+    run.add_argument('--image-size', type=_image_size, default=(1920, 1080), help='WIDTHxHEIGHT')
+
+    compare = commands.add_parser('compare', help='Compare two result files')
+    compare.add_argument('baseline', type=str)
+    compare.add_argument('current', type=str)
+    compare.add_argument('--threshold', type=float, default=0.10,
+                         help='Relative median slowdown reported as a regression')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run_benchmarks(args)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    else:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        with open(args.current, 'r') as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+_MISSING = object()
+
+
+def canonical_key(*parts: Any) -> str:
+    """Hash JSON-like values so that dict key order does not matter"""
+    encoded = json.dumps(
+        parts,
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # Guards the hand-off between the executor thread starting the work
+        # and the last waiter cancelling it
+        self.lock = threading.Lock()
+        self.started = False
+        self.cancelled = False
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key starts `fn` on the default executor; callers
+    arriving while it runs await the same result, and an exception is raised
+    to every one of them. When every waiter is cancelled (e.g. the clients
+    disconnected) an execution still queued for an executor thread is
+    cancelled and never runs. One that already started cannot be
+    interrupted, so it runs to completion and stays registered until then;
+    callers arriving in the meantime attach to it instead of starting a
+    second one. Successful results are kept for `ttl` seconds so duplicates
+    arriving just after completion are served from memory.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._inflight: Dict[str, _Call] = {}
+        self._cache: 'OrderedDict[str, tuple]' = OrderedDict()
+        self.counters = {
+            'requests': 0,
+            'executions': 0,
+            'coalesced': 0,
+            'cache_hits': 0,
+            'errors': 0,
+            'cancelled': 0,
+            'abandoned': 0,
+        }
+
+    def _cache_get(self, key: str) -> Any:
+        entry = self._cache.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return _MISSING
+        self._cache.move_to_end(key)
+        return value
+
+    def _cache_put(self, key: str, value: Any):
+        if self.ttl <= 0:
+            return
+        self._cache[key] = (time.monotonic() + self.ttl, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _execute(self, key: str, call: _Call, fn: Callable, args: tuple) -> Any:
+        def run():
+            with call.lock:
+                if call.cancelled:
+                    return None
+                call.started = True
+            return fn(*args)
+
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(None, run)
+        except Exception:
+            self.counters['errors'] += 1
+            raise
+        finally:
+            call = self._inflight.get(key)
+            if call is not None and call.task is asyncio.current_task():
+                del self._inflight[key]
+        self._cache_put(key, result)
+        return result
+
+    async def do(self, key: str, fn: Callable, *args: Any) -> Any:
+        """Return fn(*args), sharing the execution with concurrent callers of `key`"""
+        self.counters['requests'] += 1
+
+        cached = self._cache_get(key)
+        if cached is not _MISSING:
+            self.counters['cache_hits'] += 1
+            return cached
+
+        call = self._inflight.get(key)
+        if call is None:
+            call = _Call()
+            call.task = asyncio.get_running_loop().create_task(
+                self._execute(key, call, fn, args)
+            )
+            # Retrieve the exception even if every waiter has gone away
+            call.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = call
+            self.counters['executions'] += 1
+        else:
+            self.counters['coalesced'] += 1
+
+        call.waiters += 1
+        try:
+            # shield() keeps one waiter's cancellation from cancelling the others
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody is left to receive the result
+                with call.lock:
+                    call.cancelled = not call.started
+                if call.cancelled:
+                    if self._inflight.get(key) is call:
+                        del self._inflight[key]
+                    call.task.cancel()
+                    self.counters['cancelled'] += 1
+                else:
+                    # Already running: it finishes and still fills the cache
+                    self.counters['abandoned'] += 1
+
+    def in_flight(self) -> int:
+        """Number of keys currently executing"""
+        return len(self._inflight)
+
+    def clear(self, key: Optional[str] = None):
+        """Drop cached results, for one key or all of them"""
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
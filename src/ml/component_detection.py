@@ -6,6 +6,7 @@ from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
 from torchvision.models.detection.mask_rcnn import MaskRCNNPredictor
 from typing import Dict, List, Tuple, Optional
 import numpy as np
+from metrics import timed, observe_batch
 
 class ComponentDetector(nn.Module):
     def __init__(
@@ -105,6 +106,7 @@ class ComponentDetector(nn.Module):
             
         return results
     
+    @timed('predict_components')
     def predict_components(
         self,
         image: torch.Tensor,
@@ -120,6 +122,7 @@ class ComponentDetector(nn.Module):
         Returns:
             List of detected components with their properties
         """
+        observe_batch('predict_components', len(image))
         self.eval()
         with torch.no_grad():
             predictions = self(image)
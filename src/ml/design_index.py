@@ -0,0 +1,530 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+VECTORS_FILE = 'vectors.f32'
+OFFSETS_FILE = 'offsets.u64'
+PAYLOADS_FILE = 'payloads.jsonl'
+KEYS_FILE = 'keys.txt'
+META_FILE = 'meta.json'
+IVF_CENTROIDS_FILE = 'ivf_centroids.npy'
+IVF_IDS_FILE = 'ivf_ids.i64'
+IVF_OFFSETS_FILE = 'ivf_offsets.npy'
+
+# Rows scored per matmul when scanning the memory-mapped vectors
+SCAN_CHUNK = 65536
+
+
+@dataclass
+class IndexMatch:
+    id: int
+    score: float
+    payload: Dict[str, Any]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, ids: np.ndarray, k: int):
+    if len(scores) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[part], ids[part]
+    order = np.argsort(-scores, kind='stable')
+    return scores[order], ids[order]
+
+
+class DesignIndex:
+    """
+    Append-only cosine-similarity index over design embeddings and the code
+    generated for them.
+
+    Storage lives in a single directory:
+        vectors.f32     unit-normalized float32 rows, memory-mapped for search
+        payloads.jsonl  one JSON payload per row
+        offsets.u64     byte offset of each payload line
+        keys.txt        optional exact-match key of each row, one per line
+        meta.json       dimension and IVF state
+
+    Exact search scans every row. Once `build_ivf` has been called, search
+    can instead probe the `nprobe` closest inverted lists; rows appended
+    after the last build are always scanned exactly.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self._lock = threading.Lock()
+        # (vectors, offsets) memmaps, swapped as one unit by _refresh_maps
+        self._maps = None
+
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                self.meta = json.load(f)
+            if self.meta['dim'] != dim:
+                raise ValueError(
+                    f"Index at {path} has dim {self.meta['dim']}, expected {dim}"
+                )
+        else:
+            self.meta = {'dim': dim, 'ivf': None}
+            self._write_meta()
+
+        for name in (VECTORS_FILE, OFFSETS_FILE, PAYLOADS_FILE, KEYS_FILE):
+            open(os.path.join(path, name), 'ab').close()
+
+        # A crash between writes can leave a partial row; the shorter file wins
+        vector_rows = os.path.getsize(self._file(VECTORS_FILE)) // (4 * dim)
+        offset_rows = os.path.getsize(self._file(OFFSETS_FILE)) // 8
+        self._count = min(vector_rows, offset_rows)
+        self._truncate(self._count)
+        self._keys = self._load_keys(self._count)
+
+        # (centroids, ids, offsets, indexed row count), swapped as one unit
+        # so a search never mixes lists from two builds
+        self._ivf = None
+        if self.meta['ivf']:
+            self._ivf = self._load_ivf(self.meta['ivf']['count'])
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _write_meta(self):
+        tmp_path = self._file(META_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self._file(META_FILE))
+
+    def _truncate(self, count: int):
+        with open(self._file(VECTORS_FILE), 'r+b') as f:
+            f.truncate(count * 4 * self.dim)
+        with open(self._file(OFFSETS_FILE), 'r+b') as f:
+            f.truncate(count * 8)
+
+    def _load_keys(self, count: int) -> Dict[str, int]:
+        """Read the key of each row, dropping lines past `count` and padding missing ones"""
+        with open(self._file(KEYS_FILE), 'rb') as f:
+            data = f.read()
+        lines = data.split(b'\n')[:-1][:count]
+        lines += [b''] * (count - len(lines))
+        expected = b''.join(line + b'\n' for line in lines)
+        if data != expected:
+            with open(self._file(KEYS_FILE), 'wb') as f:
+                f.write(expected)
+        keys = {}
+        for idx, line in enumerate(lines):
+            if line:
+                keys.setdefault(line.decode('utf-8'), idx)
+        return keys
+
+    def _refresh_maps(self):
+        """
+        Return (vectors, offsets) covering every row added so far. Callers
+        use the returned pair rather than the attributes, so rows appended
+        concurrently never leave them with a count the map does not cover.
+        """
+        maps = self._maps
+        if maps is not None and len(maps[1]) == self._count:
+            return maps
+        with self._lock:
+            maps = (
+                np.memmap(
+                    self._file(VECTORS_FILE), dtype=np.float32, mode='r',
+                    shape=(self._count, self.dim)
+                ),
+                np.memmap(
+                    self._file(OFFSETS_FILE), dtype=np.uint64, mode='r',
+                    shape=(self._count,)
+                ),
+            )
+            self._maps = maps
+        return maps
+
+    def add(
+        self,
+        embedding: np.ndarray,
+        payload: Dict[str, Any],
+        key: Optional[str] = None
+    ) -> int:
+        """Append a single embedding and its payload, returning the row id"""
+        keys = None if key is None else [key]
+        return self.add_batch(np.asarray(embedding)[None, :], [payload], keys)[0]
+
+    def add_batch(
+        self,
+        embeddings: np.ndarray,
+        payloads: Sequence[Dict[str, Any]],
+        keys: Optional[Sequence[Optional[str]]] = None
+    ) -> List[int]:
+        """
+        Append rows in bulk, returning their ids. A row whose key is already
+        stored is not appended again; the existing row's id is returned.
+        """
+        embeddings = _normalize(embeddings)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of shape (n, {self.dim})")
+        if len(embeddings) != len(payloads):
+            raise ValueError("embeddings and payloads must have the same length")
+        keys = list(keys) if keys is not None else [None] * len(payloads)
+        if len(keys) != len(payloads):
+            raise ValueError("keys and payloads must have the same length")
+        if any(key is not None and (not key or '\n' in key) for key in keys):
+            raise ValueError("keys must be non-empty and contain no newlines")
+
+        with self._lock:
+            ids: List[Optional[int]] = []
+            new_rows, seen = [], {}
+            for i, key in enumerate(keys):
+                existing = self._keys.get(key) if key is not None else None
+                if existing is None and key is not None:
+                    existing = seen.get(key)
+                if existing is not None:
+                    ids.append(existing)
+                    continue
+                row = self._count + len(new_rows)
+                if key is not None:
+                    seen[key] = row
+                new_rows.append(i)
+                ids.append(row)
+            if not new_rows:
+                return ids
+
+            lines = [
+                (json.dumps(payloads[i], separators=(',', ':')) + '\n').encode('utf-8')
+                for i in new_rows
+            ]
+            # Vectors last: the row count comes from the shorter of the
+            # vector and offset files, so a row only exists once its vector
+            # is written; longer payload and key files are trimmed on open.
+            with open(self._file(PAYLOADS_FILE), 'ab') as f:
+                start = f.tell()
+                f.write(b''.join(lines))
+            offsets = start + np.cumsum([0] + [len(line) for line in lines[:-1]])
+            with open(self._file(OFFSETS_FILE), 'ab') as f:
+                f.write(offsets.astype(np.uint64).tobytes())
+            with open(self._file(KEYS_FILE), 'ab') as f:
+                f.write(''.join((keys[i] or '') + '\n' for i in new_rows).encode('utf-8'))
+            with open(self._file(VECTORS_FILE), 'ab') as f:
+                f.write(embeddings[new_rows].tobytes())
+
+            self._count += len(new_rows)
+            self._keys.update(seen)
+            return ids
+
+    def find(self, key: str) -> Optional[int]:
+        """Return the id of the row stored under `key`, if any"""
+        return self._keys.get(key)
+
+    def payload(self, idx: int) -> Dict[str, Any]:
+        """Read the payload stored for row `idx`"""
+        _, offsets = self._refresh_maps()
+        with open(self._file(PAYLOADS_FILE), 'rb') as f:
+            f.seek(int(offsets[idx]))
+            return json.loads(f.readline())
+
+    def _scan(self, vectors: np.ndarray, query: np.ndarray, start: int, stop: int, k: int):
+        best_scores = np.empty((0,), dtype=np.float32)
+        best_ids = np.empty((0,), dtype=np.int64)
+        for chunk_start in range(start, stop, SCAN_CHUNK):
+            chunk_stop = min(chunk_start + SCAN_CHUNK, stop)
+            scores = vectors[chunk_start:chunk_stop] @ query
+            ids = np.arange(chunk_start, chunk_stop, dtype=np.int64)
+            best_scores, best_ids = _top_k(
+                np.concatenate([best_scores, scores]),
+                np.concatenate([best_ids, ids]),
+                k
+            )
+        return best_scores, best_ids
+
+    def _probe(self, vectors: np.ndarray, ivf, query: np.ndarray, k: int, nprobe: int):
+        centroids, ivf_ids, ivf_offsets, _ = ivf
+        nprobe = min(nprobe, len(centroids))
+        lists = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        ids = np.concatenate([
+            ivf_ids[ivf_offsets[i]:ivf_offsets[i + 1]]
+            for i in lists
+        ])
+        # Sorted ids turn the gather into mostly sequential reads
+        ids.sort()
+        scores = vectors[ids] @ query
+        return _top_k(scores, ids, k)
+
+    def search(
+        self,
+        embedding: np.ndarray,
+        k: int = 1,
+        nprobe: Optional[int] = None
+    ) -> List[IndexMatch]:
+        """
+        Return the `k` most similar rows. With `nprobe` set and an IVF built,
+        only the closest `nprobe` lists (plus unindexed rows) are scored.
+        """
+        if self._count == 0:
+            return []
+        # IVF first: it never covers more rows than the maps taken after it
+        ivf = self._ivf
+        vectors, _ = self._refresh_maps()
+        count = len(vectors)
+        query = _normalize(embedding).reshape(self.dim)
+
+        if nprobe and ivf:
+            indexed = ivf[3]
+            probe_scores, probe_ids = self._probe(vectors, ivf, query, k, nprobe)
+            tail_scores, tail_ids = self._scan(vectors, query, indexed, count, k)
+            scores, ids = _top_k(
+                np.concatenate([probe_scores, tail_scores]),
+                np.concatenate([probe_ids, tail_ids]),
+                k
+            )
+        else:
+            scores, ids = self._scan(vectors, query, 0, count, k)
+
+        return [
+            IndexMatch(id=int(i), score=float(s), payload=self.payload(int(i)))
+            for s, i in zip(scores, ids)
+        ]
+
+    def lookup(
+        self,
+        embedding: np.ndarray,
+        threshold: float,
+        nprobe: Optional[int] = None
+    ) -> Optional[IndexMatch]:
+        """Return the nearest row if its similarity is at least `threshold`"""
+        matches = self.search(embedding, k=1, nprobe=nprobe)
+        if matches and matches[0].score >= threshold:
+            return matches[0]
+        return None
+
+    def build_ivf(
+        self,
+        nlist: Optional[int] = None,
+        iterations: int = 10,
+        sample_size: int = 256,
+        seed: int = 0
+    ):
+        """
+        Train spherical k-means centroids on a sample of the rows and assign
+        every current row to its nearest list.
+        """
+        if self._count == 0:
+            return
+        vectors, _ = self._refresh_maps()
+        count = len(vectors)
+        nlist = min(nlist or max(1, int(np.sqrt(count))), count)
+        rng = np.random.default_rng(seed)
+
+        sample_ids = np.sort(rng.choice(count, size=min(count, nlist * sample_size), replace=False))
+        sample = np.asarray(vectors[sample_ids])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.bincount(assign, minlength=nlist) == 0
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+
+        assign = np.empty((count,), dtype=np.int64)
+        for start in range(0, count, SCAN_CHUNK):
+            stop = min(start + SCAN_CHUNK, count)
+            assign[start:stop] = np.argmax(vectors[start:stop] @ centroids.T, axis=1)
+
+        ids = np.argsort(assign, kind='stable').astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+
+        # Written beside the live files and renamed over them, so searches
+        # still holding the previous memmap keep reading a complete file
+        with self._lock:
+            for name, write in (
+                (IVF_CENTROIDS_FILE, lambda f: np.save(f, centroids)),
+                (IVF_OFFSETS_FILE, lambda f: np.save(f, offsets)),
+                (IVF_IDS_FILE, ids.tofile),
+            ):
+                with open(self._file(name + '.tmp'), 'wb') as f:
+                    write(f)
+                os.replace(self._file(name + '.tmp'), self._file(name))
+            self.meta['ivf'] = {'nlist': int(nlist), 'count': int(count)}
+            self._write_meta()
+            self._ivf = self._load_ivf(count)
+
+    def unindexed(self) -> int:
+        """Rows appended since the last build_ivf, which search scans exactly"""
+        ivf = self._ivf
+        return self._count - (ivf[3] if ivf else 0)
+
+    def _load_ivf(self, count: int):
+        ids = np.memmap(
+            self._file(IVF_IDS_FILE), dtype=np.int64, mode='r', shape=(count,)
+        )
+        return (
+            np.load(self._file(IVF_CENTROIDS_FILE)),
+            ids,
+            np.load(self._file(IVF_OFFSETS_FILE)),
+            count,
+        )
+
+
+def _number(value: Any) -> float:
+    try:
+        value = float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    return value if np.isfinite(value) else 0.0
+
+
+def _size_bucket(value: Any) -> int:
+    return int(np.log2(max(_number(value), 1.0)))
+
+
+def _iter_nodes(root: Any):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        yield node
+        children = node.get('children')
+        if isinstance(children, list):
+            stack.extend(reversed(children))
+
+
+def _as_list(value: Any) -> list:
+    return value if isinstance(value, list) else []
+
+
+def _node_features(node: Dict[str, Any]) -> List[str]:
+    node_type = node.get('type', '')
+    features = [
+        f"type:{node_type}",
+        f"name:{node.get('name', '')}",
+        f"box:{node_type}:{_size_bucket(node.get('width'))}:{_size_bucket(node.get('height'))}",
+        f"pos:{node_type}:{_size_bucket(node.get('x'))}:{_size_bucket(node.get('y'))}",
+    ]
+    if node.get('characters'):
+        features.append(f"text:{node['characters']}")
+    for field in ('fills', 'strokes', 'effects'):
+        for style in _as_list(node.get(field)):
+            features.append(f"{field}:{_canonical_json(style)}")
+    if node.get('layout'):
+        features.append(f"layout:{_canonical_json(node['layout'])}")
+    return features
+
+
+def _canonical_json(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def _hash_features(features, dim: int) -> np.ndarray:
+    vector = np.zeros((dim,), dtype=np.float32)
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], 'little') % dim
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[bucket] += sign
+    return vector
+
+
+# Hashed copies of the settings, so a collision cannot erase their component
+_SETTINGS_FEATURES = 16
+
+
+def embed_figma_design(
+    design_data: Dict[str, Any],
+    dim: int = 256,
+    settings: Optional[Dict[str, Any]] = None
+) -> np.ndarray:
+    """
+    Hash the structure, style and content of a Figma document, together
+    with the conversion settings, into a fixed-size vector.
+
+    Each node contributes its type, name, coarse (log2) size and position,
+    text, fills, strokes, effects and layout, so near-duplicate files land
+    close together regardless of node order. The settings add a component
+    as large as the design's own, so the same design under different
+    settings scores about 0.5 and never passes a lookup threshold.
+    Malformed fields are skipped rather than raising.
+    """
+    root = design_data.get('document', design_data) if isinstance(design_data, dict) else None
+    embedding = _hash_features(
+        (feature for node in _iter_nodes(root) for feature in _node_features(node)),
+        dim
+    )
+    settings_json = _canonical_json(settings or {})
+    component = _hash_features(
+        (f"settings:{i}:{settings_json}" for i in range(_SETTINGS_FEATURES)),
+        dim
+    )
+    component *= np.linalg.norm(embedding) / max(np.linalg.norm(component), 1e-12)
+    return embedding + component
+
+
+def main():
+    import argparse
+    import shutil
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Benchmark DesignIndex recall and latency')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 16, 64])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        path = tempfile.mkdtemp(prefix='design-index-')
+        try:
+            index = DesignIndex(path, args.dim)
+            # Clustered data: designs tend to come in families of variants
+            centers = rng.standard_normal((max(1, size // 100), args.dim)).astype(np.float32)
+            for start in range(0, size, 100_000):
+                n = min(100_000, size - start)
+                rows = centers[rng.integers(0, len(centers), n)]
+                rows += rng.standard_normal(rows.shape).astype(np.float32)
+                index.add_batch(rows, [{'i': start + i} for i in range(n)])
+
+            start = time.perf_counter()
+            index.build_ivf()
+            build_s = time.perf_counter() - start
+
+            queries = centers[rng.integers(0, len(centers), args.queries)]
+            queries += rng.standard_normal(queries.shape).astype(np.float32)
+
+            def run(nprobe):
+                results, latencies = [], []
+                for query in queries:
+                    start = time.perf_counter()
+                    results.append({m.id for m in index.search(query, args.k, nprobe)})
+                    latencies.append((time.perf_counter() - start) * 1000)
+                return results, np.array(latencies)
+
+            exact, exact_ms = run(None)
+            print(f"n={size} dim={args.dim} k={args.k} "
+                  f"nlist={index.meta['ivf']['nlist']} ivf_build={build_s:.1f}s")
+            print(f"  exact        p50={np.percentile(exact_ms, 50):7.2f}ms "
+                  f"p95={np.percentile(exact_ms, 95):7.2f}ms recall@{args.k}=1.000")
+            for nprobe in args.nprobe:
+                approx, approx_ms = run(nprobe)
+                recall = np.mean([len(a & e) / args.k for a, e in zip(approx, exact)])
+                print(f"  nprobe={nprobe:<5} p50={np.percentile(approx_ms, 50):7.2f}ms "
+                      f"p95={np.percentile(approx_ms, 95):7.2f}ms recall@{args.k}={recall:.3f}")
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
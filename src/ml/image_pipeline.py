@@ -0,0 +1,179 @@
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple, Union
+
+import numpy as np
+import torch
+from PIL import Image
+
+IMAGE_SIZE: Tuple[int, int] = (224, 224)
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# Normalize((x / 255 - mean) / std) folded into a single affine x * scale - shift
+_SCALE = torch.from_numpy(1.0 / (255.0 * IMAGENET_STD)).view(3, 1, 1)
+_SHIFT = torch.from_numpy(IMAGENET_MEAN / IMAGENET_STD).view(3, 1, 1)
+
+# Modes whose RGB conversion commutes with resampling, so it can run on the
+# small image. Alpha modes are excluded: resize premultiplies alpha, while
+# convert('RGB') just drops it, so they are converted first like before.
+_RESIZABLE_MODES = {'RGB', 'L'}
+
+# Integer pre-reduction gap used by Image.resize; 2.0 matches Image.thumbnail
+REDUCING_GAP = 2.0
+
+ImageSource = Union[bytes, str, os.PathLike]
+
+_decode_pool = ThreadPoolExecutor(
+    max_workers=min(4, os.cpu_count() or 1),
+    thread_name_prefix='image-decode'
+)
+
+
+def decode_image(source: ImageSource, size: Tuple[int, int] = IMAGE_SIZE) -> Image.Image:
+    """
+    Open an image, asking the codec for the smallest decode that still
+    covers `size`. JPEG uses DCT-domain draft scaling; other formats are
+    decoded in full.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    if image.format == 'JPEG':
+        image.draft('RGB', size)
+    image.load()
+    return image
+
+
+def resize_image(image: Image.Image, size: Tuple[int, int] = IMAGE_SIZE) -> Image.Image:
+    """
+    Resize to `size` and convert to RGB. Large images are first shrunk by an
+    integer box reduction (Image.reduce) before the bilinear resample. For RGB
+    and greyscale input the RGB conversion runs on the small result; every
+    other mode is converted first, matching Image.open().convert('RGB').
+    """
+    if image.mode not in _RESIZABLE_MODES:
+        image = image.convert('RGB')
+    if image.size != size:
+        image = image.resize(size, Image.BILINEAR, reducing_gap=REDUCING_GAP)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def to_normalized_tensor(image: Image.Image) -> torch.Tensor:
+    """
+    Equivalent to ToTensor() + Normalize(IMAGENET_MEAN, IMAGENET_STD), but
+    converts uint8 HWC to float CHW in one copy and normalizes in place.
+    """
+    pixels = torch.from_numpy(np.array(image, dtype=np.uint8))
+    height, width = pixels.shape[:2]
+    tensor = torch.empty((3, height, width), dtype=torch.float32)
+    tensor.copy_(pixels.permute(2, 0, 1))
+    return tensor.mul_(_SCALE).sub_(_SHIFT)
+
+
+def load_image_tensor(
+    source: ImageSource,
+    size: Tuple[int, int] = IMAGE_SIZE
+) -> torch.Tensor:
+    """Decode, resize and normalize an image into a (3, H, W) tensor"""
+    return to_normalized_tensor(resize_image(decode_image(source, size), size))
+
+
+async def load_image_tensor_async(
+    source: ImageSource,
+    size: Tuple[int, int] = IMAGE_SIZE
+) -> torch.Tensor:
+    """Run load_image_tensor on the decode worker pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_decode_pool, load_image_tensor, source, size)
+
+
+def time_stages(
+    source: ImageSource,
+    size: Tuple[int, int] = IMAGE_SIZE
+) -> Dict[str, float]:
+    """Return per-stage wall time in milliseconds for a single image"""
+    timings = {}
+
+    start = time.perf_counter()
+    image = decode_image(source, size)
+    timings['decode'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    image = resize_image(image, size)
+    timings['resize'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    to_normalized_tensor(image)
+    timings['normalize'] = (time.perf_counter() - start) * 1000
+
+    timings['total'] = timings['decode'] + timings['resize'] + timings['normalize']
+    return timings
+
+
+def _time_baseline(data: bytes) -> Dict[str, float]:
+    """Per-stage timings of the previous Image.open().convert() + torchvision path"""
+    import torchvision.transforms as transforms
+
+    timings = {}
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(data)).convert('RGB')
+    timings['decode'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    image = transforms.Resize(IMAGE_SIZE)(image)
+    timings['resize'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    transforms.Normalize(mean=IMAGENET_MEAN.tolist(), std=IMAGENET_STD.tolist())(
+        transforms.ToTensor()(image)
+    )
+    timings['normalize'] = (time.perf_counter() - start) * 1000
+
+    timings['total'] = timings['decode'] + timings['resize'] + timings['normalize']
+    return timings
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Time the image decode pipeline')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs per size and format')
+    args = parser.parse_args()
+
+    export_sizes = {
+        '1080p': (1920, 1080),
+        '1440p': (2560, 1440),
+        '4K': (3840, 2160),
+    }
+    rng = np.random.default_rng(0)
+
+    print(f"{'size':<7}{'format':<7}{'pipeline':<10}"
+          f"{'decode':>9}{'resize':>9}{'normalize':>11}{'total':>9}  (ms)")
+    for label, (width, height) in export_sizes.items():
+        # Flat blocks with a little noise, roughly like a UI export
+        blocks = rng.integers(0, 256, size=(height // 64 + 1, width // 64 + 1, 3), dtype=np.uint8)
+        pixels = np.repeat(np.repeat(blocks, 64, axis=0), 64, axis=1)[:height, :width]
+        pixels = np.clip(pixels + rng.integers(0, 8, size=pixels.shape), 0, 255).astype(np.uint8)
+        image = Image.fromarray(pixels)
+
+        for fmt in ('PNG', 'JPEG'):
+            buffer = io.BytesIO()
+            image.save(buffer, format=fmt)
+            data = buffer.getvalue()
+
+            for name, fn in (('baseline', _time_baseline), ('pipeline', time_stages)):
+                runs = [fn(data) for _ in range(args.repeats)]
+                avg = {k: sum(r[k] for r in runs) / len(runs) for k in runs[0]}
+                print(f"{label:<7}{fmt:<7}{name:<10}"
+                      f"{avg['decode']:>9.1f}{avg['resize']:>9.1f}"
+                      f"{avg['normalize']:>11.2f}{avg['total']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    tenant TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority DESC, seq);
+CREATE INDEX IF NOT EXISTS jobs_tenant ON jobs (tenant, status);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+"""
+
+
+class QueueFull(Exception):
+    """Raised by submit when the queue is at capacity"""
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue drained by a fixed pool of worker threads.
+
+    Jobs are claimed by highest priority, then submission order, skipping
+    tenants that already have `per_tenant_limit` jobs running. Once
+    `max_queued` jobs are waiting, or `per_tenant_queued` for the submitting
+    tenant, submit raises QueueFull. Jobs that were running when the process
+    stopped are queued again on the next start. Finished jobs are deleted
+    `retention_hours` after they finish, by the workers at most once every
+    `sweep_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        handler: Callable[[Dict[str, Any]], Any],
+        num_workers: int = 2,
+        per_tenant_limit: int = 1,
+        max_queued: int = 1000,
+        per_tenant_queued: int = 100,
+        retention_hours: float = 24.0,
+        sweep_interval: float = 60.0
+    ):
+        self.handler = handler
+        self.num_workers = num_workers
+        self.per_tenant_limit = per_tenant_limit
+        self.max_queued = max_queued
+        self.per_tenant_queued = per_tenant_queued
+        self.retention_hours = retention_hours
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+
+        self._cond = threading.Condition()
+        self._running: Dict[str, int] = {}
+        self._workers: List[threading.Thread] = []
+        self._stopping = False
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        self._db.execute(
+            'UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?',
+            (QUEUED, RUNNING)
+        )
+
+    def start(self):
+        self._stopping = False
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop claiming jobs and wait for the running ones to finish"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def close(self):
+        self.stop()
+        self._db.close()
+
+    def submit(self, payload: Dict[str, Any], tenant: str = 'default', priority: int = 0) -> str:
+        """Persist a job and return its id"""
+        job_id = uuid.uuid4().hex
+        with self._cond:
+            (queued,) = self._db.execute(
+                'SELECT COUNT(*) FROM jobs WHERE status = ?', (QUEUED,)
+            ).fetchone()
+            if queued >= self.max_queued:
+                raise QueueFull(f"{queued} jobs already queued")
+            (tenant_queued,) = self._db.execute(
+                'SELECT COUNT(*) FROM jobs WHERE tenant = ? AND status = ?', (tenant, QUEUED)
+            ).fetchone()
+            if tenant_queued >= self.per_tenant_queued:
+                raise QueueFull(f"{tenant_queued} jobs already queued for tenant {tenant}")
+            self._db.execute(
+                'INSERT INTO jobs (id, tenant, priority, status, payload, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, tenant, priority, QUEUED, json.dumps(payload), time.time())
+            )
+            self._cond.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the job record, or None for an unknown id"""
+        with self._cond:
+            row = self._db.execute(
+                'SELECT id, tenant, priority, status, result, error, '
+                'created_at, started_at, finished_at FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(
+            ('id', 'tenant', 'priority', 'status', 'result', 'error',
+             'created_at', 'started_at', 'finished_at'),
+            row
+        ))
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def depth(self) -> int:
+        """Number of jobs waiting to run"""
+        with self._cond:
+            (queued,) = self._db.execute(
+                'SELECT COUNT(*) FROM jobs WHERE status = ?', (QUEUED,)
+            ).fetchone()
+        return queued
+
+    def running(self) -> int:
+        """Number of jobs currently executing"""
+        with self._cond:
+            return sum(self._running.values())
+
+    def purge(self, older_than: Optional[float] = None) -> int:
+        """
+        Delete finished jobs that finished more than `older_than` seconds ago
+        (default: the retention period), returning how many were removed
+        """
+        if older_than is None:
+            older_than = self.retention_hours * 3600
+        with self._cond:
+            cursor = self._db.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                (SUCCEEDED, FAILED, time.time() - older_than)
+            )
+            self._last_sweep = time.monotonic()
+        return cursor.rowcount
+
+    def _claim(self):
+        busy = [t for t, n in self._running.items() if n >= self.per_tenant_limit]
+        row = self._db.execute(
+            'SELECT seq, id, tenant, payload FROM jobs WHERE status = ? '
+            f"AND tenant NOT IN ({','.join('?' * len(busy))}) "
+            'ORDER BY priority DESC, seq LIMIT 1',
+            (QUEUED, *busy)
+        ).fetchone()
+        if row is None:
+            return None
+        seq, job_id, tenant, payload = row
+        self._db.execute(
+            'UPDATE jobs SET status = ?, started_at = ? WHERE seq = ?',
+            (RUNNING, time.time(), seq)
+        )
+        self._running[tenant] = self._running.get(tenant, 0) + 1
+        return seq, job_id, tenant, json.loads(payload)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = None
+                while not self._stopping:
+                    if time.monotonic() - self._last_sweep >= self.sweep_interval:
+                        self.purge()
+                    job = self._claim()
+                    if job is not None:
+                        break
+                    # Idle workers wake up to run the retention sweep too
+                    self._cond.wait(self.sweep_interval)
+                if job is None:
+                    return
+            seq, job_id, tenant, payload = job
+
+            result, error = None, None
+            try:
+                result = json.dumps(self.handler(payload))
+            except Exception as e:
+                error = str(e)
+
+            with self._cond:
+                self._db.execute(
+                    'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? '
+                    'WHERE seq = ?',
+                    (FAILED if error is not None else SUCCEEDED, result, error, time.time(), seq)
+                )
+                self._running[tenant] -= 1
+                # A tenant slot freed up, so a skipped job may now be claimable
+                self._cond.notify_all()
+
+
+def main():
+    import argparse
+    import os
+    import random
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Load test the conversion job queue')
+    parser.add_argument('--jobs', type=int, default=400)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--tenants', type=int, default=4)
+    parser.add_argument('--per-tenant-limit', type=int, default=2)
+    parser.add_argument('--large-fraction', type=float, default=0.1)
+    parser.add_argument('--small-seconds', type=float, default=0.01)
+    parser.add_argument('--large-seconds', type=float, default=0.25)
+    args = parser.parse_args()
+
+    def handler(payload):
+        # Stand-in for a conversion whose cost grows with the design size
+        time.sleep(payload['seconds'])
+        return {'size': payload['size']}
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(
+            os.path.join(tmp, 'jobs.sqlite3'),
+            handler,
+            num_workers=args.workers,
+            per_tenant_limit=args.per_tenant_limit,
+            max_queued=args.jobs,
+            per_tenant_queued=args.jobs
+        )
+        ids = {}
+        start = time.perf_counter()
+        queue.start()
+        for _ in range(args.jobs):
+            size = 'large' if rng.random() < args.large_fraction else 'small'
+            seconds = args.large_seconds if size == 'large' else args.small_seconds
+            job_id = queue.submit(
+                {'size': size, 'seconds': seconds},
+                tenant=f'tenant-{rng.randrange(args.tenants)}',
+                # Interactive small jobs jump ahead of bulk ones
+                priority=1 if size == 'small' else 0
+            )
+            ids[job_id] = size
+        while queue.depth() or queue.running():
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        queue.close()
+
+        queue = JobQueue(os.path.join(tmp, 'jobs.sqlite3'), handler)
+        waits: Dict[str, List[float]] = {'small': [], 'large': []}
+        for job_id, size in ids.items():
+            job = queue.get(job_id)
+            waits[size].append((job['started_at'] - job['created_at']) * 1000)
+        queue.close()
+
+    ideal = sum(
+        args.large_seconds if s == 'large' else args.small_seconds for s in ids.values()
+    ) / args.workers
+    print(f"{args.jobs} jobs, {args.workers} workers, {args.tenants} tenants, "
+          f"per-tenant limit {args.per_tenant_limit}")
+    print(f"throughput {args.jobs / elapsed:.1f} jobs/s, wall {elapsed:.2f}s "
+          f"(ideal {ideal:.2f}s)")
+    for size, values in waits.items():
+        if not values:
+            continue
+        values.sort()
+        p50 = values[len(values) // 2]
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"  {size:<6} n={len(values):<4} queue wait p50={p50:8.1f}ms p95={p95:8.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
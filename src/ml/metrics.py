@@ -0,0 +1,321 @@
+import bisect
+import contextlib
+import functools
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Set ML_METRICS=0 to turn every timer and counter below into a flag check
+_enabled = os.environ.get('ML_METRICS', '1') != '0'
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 1024, 4096, 16384)
+
+_registry: List['_Metric'] = []
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(flag: bool):
+    global _enabled
+    _enabled = flag
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Return the child for one combination of label values"""
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        for suffix, names, values, value in self._samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}')
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from `function` at scrape time"""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield '', self.labelnames, values, child.get()
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield '', self.labelnames, values, child.get()
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        names = self.labelnames + ('le',)
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield '_bucket', names, values + (_format_value(bound),), cumulative
+            yield '_sum', self.labelnames, values, total
+            yield '_count', self.labelnames, values, cumulative
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS = Histogram(
+    'ml_stage_seconds',
+    'Wall time spent in each processing stage',
+    ['stage']
+)
+BATCH_SIZE = Histogram(
+    'ml_batch_size',
+    'Number of items per call of a batched stage',
+    ['stage'],
+    buckets=SIZE_BUCKETS
+)
+
+
+class _StageTimer:
+    __slots__ = ('child', 'start')
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def stage(name: str):
+    """Context manager recording the duration of the block under `name`"""
+    if not _enabled:
+        return _NULL_TIMER
+    return _StageTimer(STAGE_SECONDS.labels(name))
+
+
+def timed(name: str):
+    """Decorator recording the duration of every call under `name`"""
+    child = STAGE_SECONDS.labels(name)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def observe_batch(name: str, size: int):
+    if _enabled:
+        BATCH_SIZE.labels(name).observe(size)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measure instrumentation overhead')
+    parser.add_argument('--calls', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    def noop(x):
+        return x
+
+    instrumented = timed('benchmark')(noop)
+
+    def per_call_ns(fn, repeats=3):
+        # Best of several runs to keep scheduler noise out of the comparison
+        best = math.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for i in range(args.calls):
+                fn(i)
+            best = min(best, time.perf_counter() - start)
+        return best / args.calls * 1e9
+
+    def stage_ns():
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            with stage('benchmark'):
+                pass
+        return (time.perf_counter() - start) / args.calls * 1e9
+
+    baseline = per_call_ns(noop)
+    set_enabled(False)
+    disabled, disabled_stage = per_call_ns(instrumented), stage_ns()
+    set_enabled(True)
+    active, active_stage = per_call_ns(instrumented), stage_ns()
+
+    print(f"plain call            {baseline:7.1f} ns")
+    print(f"@timed, disabled      {disabled:7.1f} ns  (+{disabled - baseline:.1f} ns)")
+    print(f"@timed, enabled       {active:7.1f} ns  (+{active - baseline:.1f} ns)")
+    print(f"stage(), disabled     {disabled_stage:7.1f} ns")
+    print(f"stage(), enabled      {active_stage:7.1f} ns")
+
+    # Relative to the cheapest instrumented stage: a small Figma tree
+    from model import process_figma_node
+
+    tree = {'type': 'FRAME', 'children': [{'type': 'TEXT'} for _ in range(10)]}
+    raw = process_figma_node.__wrapped__
+    args.calls //= 20
+    raw_ns = per_call_ns(lambda _: raw(tree))
+    print(f"process_figma_node    {raw_ns:7.0f} ns  wrapper cost "
+          f"{(disabled - baseline) / raw_ns:.2%} disabled, "
+          f"{(active - baseline) / raw_ns:.2%} enabled")
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,14 @@
 import torch
 import torch.nn as nn
 import torchvision.models as models
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
+from metrics import timed, observe_batch
 
 class DesignEncoder(nn.Module):
-    def __init__(self, embed_dim: int = 512):
+    def __init__(self, embed_dim: int = 512, pretrained: bool = True):
         super().__init__()
         # Use ResNet50 as the base model
-        resnet = models.resnet50(pretrained=True)
+        resnet = models.resnet50(pretrained=pretrained)
         self.backbone = nn.Sequential(*list(resnet.children())[:-2])
         
         # Additional layers for design-specific features
@@ -19,10 +20,88 @@ class DesignEncoder(nn.Module):
             nn.Linear(1024, embed_dim)
         )
         
+    @timed('design_encoder_forward')
     def forward(self, x: torch.Tensor) -> torch.Tensor:
+        observe_batch('design_encoder_forward', x.size(0))
         x = self.backbone(x)
         return self.design_layers(x)
 
+class SlimDesignEncoder(nn.Module):
+    """Five strided conv blocks; a CPU-friendly stand-in for DesignEncoder"""
+    def __init__(self, embed_dim: int = 512, width: int = 32):
+        super().__init__()
+        layers = []
+        in_channels = 3
+        for out_channels in (width, width * 2, width * 4, width * 8, width * 16):
+            layers += [
+                nn.Conv2d(in_channels, out_channels, kernel_size=3, stride=2, padding=1, bias=False),
+                nn.BatchNorm2d(out_channels),
+                nn.ReLU(inplace=True)
+            ]
+            in_channels = out_channels
+        self.backbone = nn.Sequential(*layers)
+        self.design_layers = nn.Sequential(
+            nn.AdaptiveAvgPool2d((1, 1)),
+            nn.Flatten(),
+            nn.Linear(in_channels, embed_dim)
+        )
+        
+    @timed('student_encoder_forward')
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        observe_batch('student_encoder_forward', x.size(0))
+        x = self.backbone(x)
+        return self.design_layers(x)
+
+class MobileNetDesignEncoder(nn.Module):
+    """MobileNetV3 features projected to the DesignEncoder embedding size"""
+    def __init__(self, embed_dim: int = 512, variant: str = 'small', pretrained: bool = True):
+        super().__init__()
+        if variant == 'small':
+            mobilenet = models.mobilenet_v3_small(pretrained=pretrained)
+        else:
+            mobilenet = models.mobilenet_v3_large(pretrained=pretrained)
+        self.backbone = mobilenet.features
+        self.design_layers = nn.Sequential(
+            nn.AdaptiveAvgPool2d((1, 1)),
+            nn.Flatten(),
+            nn.Linear(mobilenet.classifier[0].in_features, embed_dim)
+        )
+        
+    @timed('student_encoder_forward')
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        observe_batch('student_encoder_forward', x.size(0))
+        x = self.backbone(x)
+        return self.design_layers(x)
+
+STUDENT_ENCODERS = {
+    'slim': lambda embed_dim, pretrained: SlimDesignEncoder(embed_dim),
+    'slim-wide': lambda embed_dim, pretrained: SlimDesignEncoder(embed_dim, width=48),
+    'mobilenet_v3_small': lambda embed_dim, pretrained: MobileNetDesignEncoder(embed_dim, 'small', pretrained),
+    'mobilenet_v3_large': lambda embed_dim, pretrained: MobileNetDesignEncoder(embed_dim, 'large', pretrained),
+}
+
+def build_student_encoder(name: str, embed_dim: int = 512, pretrained: bool = True) -> nn.Module:
+    """Create one of the STUDENT_ENCODERS by name"""
+    if name not in STUDENT_ENCODERS:
+        raise ValueError(f"Unknown student encoder {name!r}, expected one of {sorted(STUDENT_ENCODERS)}")
+    return STUDENT_ENCODERS[name](embed_dim, pretrained)
+
+def select_student(
+    report: List[Dict[str, Any]],
+    budget_ms: float
+) -> Optional[Dict[str, Any]]:
+    """
+    Pick the student from a distillation report that best matches the
+    teacher while staying within `budget_ms` per image.
+    """
+    candidates = [
+        entry for entry in report
+        if entry['role'] == 'student' and entry['latency_ms'] <= budget_ms
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda entry: entry['cosine_similarity'])
+
 class HTMLDecoder(nn.Module):
     def __init__(self, vocab_size: int, embed_dim: int = 512, hidden_dim: int = 512):
         super().__init__()
@@ -67,10 +146,13 @@ class DesignToCode(nn.Module):
         html_vocab_size: int,
         css_vocab_size: int,
         embed_dim: int = 512,
-        hidden_dim: int = 512
+        hidden_dim: int = 512,
+        pretrained: bool = True,
+        encoder: Optional[nn.Module] = None
     ):
         super().__init__()
-        self.encoder = DesignEncoder(embed_dim)
+        # A distilled student can replace the ResNet-50 encoder
+        self.encoder = encoder if encoder is not None else DesignEncoder(embed_dim, pretrained=pretrained)
         self.html_decoder = HTMLDecoder(html_vocab_size, embed_dim, hidden_dim)
         self.css_decoder = CSSDecoder(css_vocab_size, embed_dim, hidden_dim)
         
@@ -105,6 +187,7 @@ class DesignToCode(nn.Module):
             'design_features': design_features
         }
 
+@timed('process_figma_node')
 def process_figma_node(node: Dict[str, Any]) -> List[Dict[str, Any]]:
     """Process a Figma node and extract relevant design information."""
     processed_nodes = []
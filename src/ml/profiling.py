@@ -0,0 +1,221 @@
+import asyncio
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+from typing import Optional
+
+import torch
+from torch.profiler import ProfilerActivity
+
+# torch.profiler and tracemalloc are process-wide, so only one session runs at a time
+_session_lock = threading.Lock()
+
+
+class ProfileStore:
+    """
+    Directory of profile dumps bounded by total size; the oldest files are
+    removed first once `max_bytes` is exceeded. The directory is created
+    when the first profile is written.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, filename: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, filename)
+
+    def rotate(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+def _allocation_sites(snapshot: tracemalloc.Snapshot, limit: int):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    return [
+        {
+            'file': stat.traceback[0].filename,
+            'line': stat.traceback[0].lineno,
+            'size_bytes': stat.size,
+            'count': stat.count,
+        }
+        for stat in snapshot.statistics('lineno')[:limit]
+    ]
+
+
+def _start_session():
+    """Start tracemalloc and torch.profiler, or return None if a session is running"""
+    if not _session_lock.acquire(blocking=False):
+        return None
+    try:
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        profiler = torch.profiler.profile(
+            activities=activities,
+            record_shapes=True,
+            profile_memory=True
+        )
+        start = time.time()
+        profiler.start()
+    except BaseException:
+        _session_lock.release()
+        raise
+    return profiler, started_tracemalloc, start
+
+
+def _stop_profiler(session) -> float:
+    profiler, _, start = session
+    profiler.stop()
+    return time.time() - start
+
+
+def _write_session(
+    store: ProfileStore,
+    name: str,
+    session,
+    duration: float,
+    top_allocations: int
+):
+    """Snapshot and stop tracemalloc, then write both files and rotate the store"""
+    profiler, started_tracemalloc, start = session
+    snapshot = tracemalloc.take_snapshot()
+    if started_tracemalloc:
+        tracemalloc.stop()
+    prefix = '{}.{:03d}-{}'.format(
+        time.strftime('%Y%m%d-%H%M%S', time.localtime(start)),
+        int(start * 1000) % 1000,
+        re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+    )
+    profiler.export_chrome_trace(store.path(prefix + '.trace.json'))
+    with open(store.path(prefix + '.alloc.json'), 'w') as f:
+        json.dump({
+            'name': name,
+            'duration_s': duration,
+            'top_allocations': _allocation_sites(snapshot, top_allocations),
+        }, f, indent=2)
+    store.rotate()
+
+
+def _finish_session(store: ProfileStore, name: str, session, duration: float, top_allocations: int):
+    try:
+        _write_session(store, name, session, duration, top_allocations)
+    finally:
+        _session_lock.release()
+
+
+@contextlib.contextmanager
+def profile_session(store: ProfileStore, name: str, top_allocations: int = 25):
+    """
+    Run the block under torch.profiler and tracemalloc, then write
+    `<timestamp>-<name>.trace.json` (Chrome trace, open in chrome://tracing
+    or Perfetto) and `<timestamp>-<name>.alloc.json` (top Python allocation
+    sites) to `store`.
+
+    Yields the profiler, or None when another session is already running.
+    """
+    session = _start_session()
+    if session is None:
+        yield None
+        return
+
+    try:
+        yield session[0]
+    finally:
+        try:
+            duration = _stop_profiler(session)
+        except BaseException:
+            _session_lock.release()
+            raise
+        _finish_session(store, name, session, duration, top_allocations)
+
+
+@contextlib.asynccontextmanager
+async def profile_session_async(store: ProfileStore, name: str, top_allocations: int = 25):
+    """
+    profile_session for coroutines: the allocation snapshot, trace export
+    and rotation run on the default executor instead of the event loop.
+
+    Both profilers are process-wide, so the files cover everything the
+    process did while the block was suspended too, including other
+    requests served concurrently on the loop or in threads.
+    """
+    session = _start_session()
+    if session is None:
+        yield None
+        return
+
+    try:
+        yield session[0]
+    finally:
+        try:
+            duration = _stop_profiler(session)
+        except BaseException:
+            _session_lock.release()
+            raise
+        # The lock is released by the writer thread, so a cancelled request
+        # cannot start a new session while the previous one is still writing
+        await asyncio.get_running_loop().run_in_executor(
+            None, _finish_session, store, name, session, duration, top_allocations
+        )
+
+
+class StepProfiler:
+    """
+    Profiles a window of `num_steps` consecutive training steps, starting
+    after `skip_steps` steps have completed. Call step() once per step.
+    """
+
+    def __init__(
+        self,
+        store: ProfileStore,
+        num_steps: int,
+        skip_steps: int = 0,
+        name: str = 'train'
+    ):
+        self.store = store
+        self.num_steps = num_steps
+        self.skip_steps = skip_steps
+        self.name = name
+        self._done = 0
+        self._session: Optional[contextlib.ExitStack] = None
+        self._toggle()
+
+    def _toggle(self):
+        if self._session is None and self._done == self.skip_steps and self.num_steps > 0:
+            self._session = contextlib.ExitStack()
+            name = f'{self.name}-steps{self.skip_steps}-{self.skip_steps + self.num_steps}'
+            self._session.enter_context(profile_session(self.store, name))
+        elif self._session is not None and self._done == self.skip_steps + self.num_steps:
+            self.close()
+
+    def step(self):
+        self._done += 1
+        self._toggle()
+
+    def close(self):
+        """Finish the window early, e.g. when training ends inside it"""
+        if self._session is not None:
+            session, self._session = self._session, None
+            session.close()
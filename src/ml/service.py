@@ -1,12 +1,24 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, UploadFile, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import torch
 import torch.nn as nn
-import torchvision.transforms as transforms
-from PIL import Image
-import io
 import json
+import logging
+import os
+import random
+import threading
+import time
+from image_pipeline import load_image_tensor_async
+from design_index import DesignIndex, embed_figma_design
+from model import build_student_encoder, select_student
+from coalescing import SingleFlight, canonical_key
+from job_queue import JobQueue, QueueFull, SUCCEEDED, FAILED
+import metrics
+from profiling import ProfileStore, profile_session_async
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -19,6 +31,21 @@ class GeneratedCode(BaseModel):
     css: str
     assets: List[Dict[str, str]]
 
+class ProfilingSettings(BaseModel):
+    sample_rate: float
+
+class JobInput(DesignInput):
+    priority: int = 0
+
+class JobStatus(BaseModel):
+    id: str
+    status: str
+    priority: int
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
 # Basic CNN encoder for processing design images
 class DesignEncoder(nn.Module):
     def __init__(self):
@@ -35,17 +62,71 @@ class DesignEncoder(nn.Module):
             nn.AdaptiveAvgPool2d((1, 1))
         )
         
+    @metrics.timed('service_encoder_forward')
     def forward(self, x):
+        metrics.observe_batch('service_encoder_forward', x.size(0))
         return self.cnn(x).squeeze()
 
+# Distilled students from `train.py --distill`, chosen by per-image CPU budget
+STUDENT_REPORT = os.environ.get('STUDENT_REPORT')
+ENCODER_BUDGET_MS = float(os.environ.get('ENCODER_BUDGET_MS', 50))
+
+def load_encoder() -> nn.Module:
+    """
+    Serve the closest-to-teacher student that fits ENCODER_BUDGET_MS,
+    falling back to the basic CNN when no report or student qualifies.
+
+    The basic CNN returns 256 features per image and a student returns its
+    embed_dim (512 for students distilled from DesignToCode), so the length
+    of /process-image features changes when a student is served.
+    """
+    if STUDENT_REPORT and os.path.exists(STUDENT_REPORT):
+        with open(STUDENT_REPORT, 'r') as f:
+            entry = select_student(json.load(f), ENCODER_BUDGET_MS)
+        if entry is not None:
+            encoder = build_student_encoder(entry['name'], entry['embed_dim'], pretrained=False)
+            checkpoint = os.path.join(os.path.dirname(STUDENT_REPORT), entry['checkpoint'])
+            encoder.load_state_dict(torch.load(checkpoint, map_location='cpu'))
+            return encoder.eval()
+    return DesignEncoder()
+
 # Initialize model (in production, load pre-trained weights)
-model = DesignEncoder()
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], 
-                       std=[0.229, 0.224, 0.225])
-])
+model = load_encoder()
+
+# Previously generated code, keyed by a structural embedding of the design
+DESIGN_INDEX_DIR = os.environ.get('DESIGN_INDEX_DIR', 'design_index')
+DESIGN_EMBED_DIM = 256
+SIMILARITY_THRESHOLD = 0.98
+# Inverted lists probed once an IVF exists; requests may raise it, not lower it
+INDEX_NPROBE = int(os.environ.get('DESIGN_INDEX_NPROBE', 16))
+# The IVF is built once the index reaches INDEX_IVF_MIN_ROWS and rebuilt every
+# INDEX_IVF_REBUILD_EVERY additions; smaller indexes are scanned exactly
+INDEX_IVF_MIN_ROWS = int(os.environ.get('DESIGN_INDEX_IVF_MIN_ROWS', 50_000))
+INDEX_IVF_REBUILD_EVERY = int(os.environ.get('DESIGN_INDEX_IVF_REBUILD_EVERY', 10_000))
+# Settings that tune the lookup rather than the generated code
+LOOKUP_SETTINGS = ('similarity_threshold', 'nprobe')
+design_index = DesignIndex(DESIGN_INDEX_DIR, DESIGN_EMBED_DIM)
+_ivf_build_lock = threading.Lock()
+
+def refresh_design_index():
+    """Build or rebuild the IVF on a background thread when it is due"""
+    if len(design_index) < INDEX_IVF_MIN_ROWS:
+        return
+    if design_index.meta['ivf'] and design_index.unindexed() < INDEX_IVF_REBUILD_EVERY:
+        return
+    if not _ivf_build_lock.acquire(blocking=False):
+        return
+
+    def build():
+        try:
+            design_index.build_ivf()
+        finally:
+            _ivf_build_lock.release()
+
+    threading.Thread(target=build, name='design-index-ivf', daemon=True).start()
+
+# Identical /convert requests arriving together share one conversion
+convert_flight = SingleFlight(ttl=30.0)
 
 def process_design(design_data: Dict[str, Any]) -> GeneratedCode:
     """
@@ -60,36 +141,276 @@ def process_design(design_data: Dict[str, Any]) -> GeneratedCode:
         assets=[]
     )
 
+def _lookup_options(settings: Dict[str, Any]):
+    """Requested threshold and nprobe, never looser than the defaults"""
+    try:
+        threshold = max(float(settings.get('similarity_threshold', SIMILARITY_THRESHOLD)),
+                        SIMILARITY_THRESHOLD)
+    except (TypeError, ValueError):
+        threshold = SIMILARITY_THRESHOLD
+    try:
+        nprobe = max(int(settings.get('nprobe') or 0), INDEX_NPROBE)
+    except (TypeError, ValueError):
+        nprobe = INDEX_NPROBE
+    return threshold, nprobe
+
+def convert_with_lookup(
+    design_data: Dict[str, Any],
+    settings: Dict[str, Any]
+) -> GeneratedCode:
+    """
+    Reuse the code of a previously converted design, otherwise run
+    process_design and remember its output.
+
+    An identical design and settings is found by key. Failing that, the
+    nearest stored design is reused when its similarity reaches the
+    threshold; the settings are part of the embedding, so only designs
+    converted with the same settings can match. Requests can tighten
+    similarity_threshold and raise nprobe, but never loosen them below
+    the service defaults. Any failure in the lookup falls through to
+    process_design.
+    """
+    code_settings = {key: value for key, value in settings.items() if key not in LOOKUP_SETTINGS}
+    design_key = canonical_key(design_data, code_settings)
+    threshold, nprobe = _lookup_options(settings)
+
+    embedding = None
+    try:
+        with metrics.stage('index_lookup'):
+            row = design_index.find(design_key)
+            if row is not None:
+                code = GeneratedCode(**design_index.payload(row))
+                INDEX_LOOKUPS.labels('exact').inc()
+                return code
+        with metrics.stage('embed_design'):
+            embedding = embed_figma_design(design_data, DESIGN_EMBED_DIM, code_settings)
+        with metrics.stage('index_lookup'):
+            matches = design_index.search(embedding, k=1, nprobe=nprobe)
+        if matches and matches[0].score >= threshold:
+            code = GeneratedCode(**matches[0].payload)
+            INDEX_LOOKUPS.labels('similar').inc()
+            return code
+        INDEX_LOOKUPS.labels('miss').inc()
+    except Exception:
+        logger.exception("Design index lookup failed")
+        INDEX_LOOKUPS.labels('error').inc()
+
+    with metrics.stage('process_design'):
+        generated_code = process_design(design_data)
+    if embedding is not None:
+        try:
+            with metrics.stage('index_add'):
+                design_index.add(embedding, generated_code.dict(), key=design_key)
+            refresh_design_index()
+        except Exception:
+            logger.exception("Design index update failed")
+    return generated_code
+
+def run_conversion_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return convert_with_lookup(payload['design_data'], payload['settings']).dict()
+
+# Long-running conversions go through a persistent queue instead of /convert
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', 'jobs.sqlite3')
+job_queue = JobQueue(
+    JOB_DB_PATH,
+    run_conversion_job,
+    num_workers=int(os.environ.get('JOB_WORKERS', 2)),
+    per_tenant_limit=int(os.environ.get('JOB_TENANT_LIMIT', 1)),
+    max_queued=int(os.environ.get('JOB_MAX_QUEUED', 1000)),
+    per_tenant_queued=int(os.environ.get('JOB_TENANT_MAX_QUEUED', 100)),
+    # Finished jobs, and their results, are deleted after this many hours
+    retention_hours=float(os.environ.get('JOB_RETENTION_HOURS', 24))
+)
+
+REQUEST_SECONDS = metrics.Histogram(
+    'ml_request_seconds',
+    'HTTP request latency by route',
+    ['method', 'route', 'status']
+)
+REQUESTS_IN_FLIGHT = metrics.Gauge(
+    'ml_requests_in_flight',
+    'HTTP requests currently being handled'
+)
+INDEX_LOOKUPS = metrics.Counter(
+    'ml_design_index_lookups_total',
+    'Similar-design lookups by outcome',
+    ['result']
+)
+CONVERT_EVENTS = metrics.Counter(
+    'ml_convert_coalescing_total',
+    '/convert requests by how they were served',
+    ['event']
+)
+for event in convert_flight.counters:
+    CONVERT_EVENTS.labels(event).set_function(
+        lambda event=event: convert_flight.counters[event]
+    )
+metrics.Gauge(
+    'ml_convert_in_flight',
+    'Distinct /convert computations currently running'
+).set_function(convert_flight.in_flight)
+metrics.Gauge('ml_job_queue_depth', 'Jobs waiting to run').set_function(job_queue.depth)
+metrics.Gauge('ml_jobs_running', 'Jobs currently running').set_function(job_queue.running)
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    if not metrics.enabled():
+        return await call_next(request)
+    REQUESTS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        # Label by route template so /jobs/{job_id} stays one series
+        route = getattr(request.scope.get('route'), 'path', 'unmatched')
+        REQUEST_SECONDS.labels(request.method, route, status).observe(
+            time.perf_counter() - start
+        )
+
+# Opt-in request profiling: send X-Profile: <PROFILE_TOKEN>, or set a sample
+# rate through /admin/profiling. Disabled when PROFILE_TOKEN is unset.
+# Profiles are process-wide, so a trace also contains whatever else ran while
+# the request was in flight; sampled requests are only profiled when no other
+# request is being served, and X-Profile traces are best read on a quiet
+# instance.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+profile_store = ProfileStore(
+    os.environ.get('PROFILE_DIR', 'profiles'),
+    max_bytes=int(os.environ.get('PROFILE_MAX_MB', 512)) * 1024 * 1024
+)
+profile_sample_rate = 0.0
+_requests_active = 0
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    global _requests_active
+    requested = PROFILE_TOKEN is not None and request.headers.get('x-profile') == PROFILE_TOKEN
+    sampled = (
+        profile_sample_rate > 0
+        and _requests_active == 0
+        and random.random() < profile_sample_rate
+    )
+    _requests_active += 1
+    try:
+        if not (requested or sampled):
+            return await call_next(request)
+        name = f"{request.method}{request.url.path}"
+        async with profile_session_async(profile_store, name):
+            return await call_next(request)
+    finally:
+        _requests_active -= 1
+
+@app.on_event("startup")
+def start_job_workers():
+    job_queue.start()
+
+@app.on_event("startup")
+def build_design_index():
+    refresh_design_index()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    # Jobs still running after the timeout are re-queued on the next start
+    job_queue.stop(timeout=10)
+
 @app.post("/convert", response_model=GeneratedCode)
 async def convert_design(design_input: DesignInput):
     """
     Convert a Figma design into HTML/CSS code
     """
     try:
-        # Process the design data
-        generated_code = process_design(design_input.design_data)
+        # Process the design data, coalescing identical concurrent requests
+        key = canonical_key(design_input.design_data, design_input.settings)
+        generated_code = await convert_flight.do(
+            key,
+            convert_with_lookup,
+            design_input.design_data,
+            design_input.settings
+        )
         return generated_code
     except Exception as e:
         return {"error": str(e)}
 
+@app.post("/jobs", status_code=202)
+async def submit_job(job_input: JobInput, x_tenant_id: str = Header('default')):
+    """
+    Queue a conversion and return its job id
+    """
+    try:
+        job_id = job_queue.submit(
+            {'design_data': job_input.design_data, 'settings': job_input.settings},
+            tenant=x_tenant_id,
+            priority=job_input.priority
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"id": job_id}
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job_status(job_id: str):
+    """
+    Return the status of a queued conversion
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatus(**job)
+
+@app.get("/jobs/{job_id}/result", response_model=GeneratedCode)
+async def get_job_result(job_id: str):
+    """
+    Return the generated code of a finished conversion
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job['status'] == FAILED:
+        raise HTTPException(status_code=500, detail=job['error'])
+    if job['status'] != SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return job['result']
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Expose counters and latency histograms in Prometheus text format
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/admin/profiling")
+async def set_profiling(profiling: ProfilingSettings, x_admin_token: str = Header(None)):
+    """
+    Profile a random fraction of requests until set back to 0
+    """
+    global profile_sample_rate
+    if PROFILE_TOKEN is None or x_admin_token != PROFILE_TOKEN:
+        raise HTTPException(status_code=403, detail="Profiling is not enabled")
+    profile_sample_rate = min(max(profiling.sample_rate, 0.0), 1.0)
+    return {"sample_rate": profile_sample_rate}
+
 @app.post("/process-image")
 async def process_image(file: UploadFile = File(...)):
     """
-    Process a single design image and return features
+    Process a single design image and return features. Their length is
+    the served encoder's output size, 256 or a student's embed_dim.
     """
     try:
-        # Read and process the image
+        # Decode and transform on the worker pool so other requests keep running
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert('RGB')
-        
-        # Transform the image
-        img_tensor = transform(image).unsqueeze(0)
+        with metrics.stage('decode'):
+            img_tensor = (await load_image_tensor_async(contents)).unsqueeze(0)
         
         # Get features (in production, this would feed into a more complex pipeline)
         with torch.no_grad():
-            features = model(img_tensor)
+            features = model(img_tensor).flatten()
         
-        return {"features": features.tolist()}
+        with metrics.stage('serialize'):
+            features = features.tolist()
+        return {"features": features}
     except Exception as e:
         return {"error": str(e)}
 
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from coalescing import SingleFlight, canonical_key
+
+
+def test_canonical_key_ignores_dict_order():
+    assert canonical_key({'a': 1, 'b': [1, 2]}) == canonical_key({'b': [1, 2], 'a': 1})
+    assert canonical_key({'a': 1}) != canonical_key({'a': 2})
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight(ttl=0)
+    release = threading.Event()
+    runs = []
+
+    def work(value):
+        runs.append(value)
+        release.wait(5)
+        return value * 2
+
+    async def scenario():
+        calls = [asyncio.ensure_future(flight.do('k', work, 21)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*calls)
+
+    assert asyncio.run(scenario()) == [42] * 5
+    assert runs == [21]
+    assert flight.counters['executions'] == 1
+    assert flight.counters['coalesced'] == 4
+    assert flight.in_flight() == 0
+
+
+def test_results_are_cached_for_ttl():
+    flight = SingleFlight(ttl=60)
+    runs = []
+
+    async def scenario():
+        first = await flight.do('k', runs.append, 1)
+        second = await flight.do('k', runs.append, 1)
+        return first, second
+
+    assert asyncio.run(scenario()) == (None, None)
+    assert runs == [1]
+    assert flight.counters['cache_hits'] == 1
+
+    flight.clear('k')
+    asyncio.run(flight.do('k', runs.append, 1))
+    assert runs == [1, 1]
+
+
+def test_error_is_raised_to_every_waiter_and_not_cached():
+    flight = SingleFlight(ttl=60)
+    release = threading.Event()
+    runs = []
+
+    def fail():
+        runs.append(1)
+        release.wait(5)
+        raise ValueError('boom')
+
+    async def scenario():
+        calls = [asyncio.ensure_future(flight.do('k', fail)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert runs == [1]
+    assert flight.counters['errors'] == 1
+
+    with pytest.raises(ValueError):
+        asyncio.run(flight.do('k', fail))
+    assert runs == [1, 1]
+
+
+def test_abandoned_execution_is_reused_instead_of_started_again():
+    flight = SingleFlight(ttl=0)
+    release = threading.Event()
+    runs = []
+
+    def work():
+        runs.append(1)
+        release.wait(5)
+        return len(runs)
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do('k', work))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert flight.counters['abandoned'] == 1
+        # The thread is still running, so a new caller re-attaches to it
+        assert flight.in_flight() == 1
+        second = asyncio.ensure_future(flight.do('k', work))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await second
+
+    assert asyncio.run(scenario()) == 1
+    assert runs == [1]
+    assert flight.counters['executions'] == 1
+    assert flight.counters['cancelled'] == 0
+    assert flight.in_flight() == 0
+
+
+def test_execution_not_yet_started_is_cancelled():
+    flight = SingleFlight(ttl=0)
+    release = threading.Event()
+    runs = []
+
+    def block():
+        release.wait(5)
+
+    async def scenario():
+        executor = ThreadPoolExecutor(max_workers=1)
+        asyncio.get_running_loop().set_default_executor(executor)
+        busy = asyncio.ensure_future(flight.do('busy', block))
+        await asyncio.sleep(0.05)
+        # Queued behind `busy`, so it has not started when its waiter leaves
+        queued = asyncio.ensure_future(flight.do('k', runs.append, 1))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert flight.in_flight() == 1
+        release.set()
+        await busy
+        executor.shutdown(wait=True)
+
+    asyncio.run(scenario())
+    assert runs == []
+    assert flight.counters['cancelled'] == 1
+    assert flight.counters['abandoned'] == 0
+
+
+def test_cancelling_one_waiter_leaves_the_others():
+    flight = SingleFlight(ttl=0)
+    release = threading.Event()
+
+    def work():
+        release.wait(5)
+        return 'done'
+
+    async def scenario():
+        calls = [asyncio.ensure_future(flight.do('k', work)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        calls[0].cancel()
+        release.set()
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    cancelled, result = asyncio.run(scenario())
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert result == 'done'
+    assert flight.counters['cancelled'] == 0
+    assert flight.counters['abandoned'] == 0
@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+import pytest
+
+from design_index import (
+    KEYS_FILE,
+    OFFSETS_FILE,
+    PAYLOADS_FILE,
+    VECTORS_FILE,
+    DesignIndex,
+    embed_figma_design,
+)
+
+DIM = 16
+
+
+def clustered_rows(n, seed=0, clusters=20):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, DIM)).astype(np.float32)
+    rows = centers[rng.integers(0, clusters, n)]
+    return rows + 0.1 * rng.standard_normal(rows.shape).astype(np.float32)
+
+
+def test_search_returns_nearest_payloads(tmp_path):
+    index = DesignIndex(str(tmp_path), DIM)
+    rows = clustered_rows(50)
+    index.add_batch(rows, [{'i': i} for i in range(50)])
+
+    matches = index.search(rows[7], k=3)
+    assert matches[0].id == 7
+    assert matches[0].payload == {'i': 7}
+    assert matches[0].score == pytest.approx(1.0, abs=1e-5)
+    assert [m.score for m in matches] == sorted((m.score for m in matches), reverse=True)
+    assert index.lookup(-rows[7], threshold=0.9) is None
+
+
+def test_reopen_keeps_rows_keys_and_ivf(tmp_path):
+    index = DesignIndex(str(tmp_path), DIM)
+    rows = clustered_rows(40)
+    index.add_batch(rows, [{'i': i} for i in range(40)], [f'key-{i}' for i in range(40)])
+    index.build_ivf(nlist=4)
+
+    reopened = DesignIndex(str(tmp_path), DIM)
+    assert len(reopened) == 40
+    assert reopened.meta['ivf'] == {'nlist': 4, 'count': 40}
+    assert reopened.find('key-12') == 12
+    assert reopened.payload(12) == {'i': 12}
+    assert reopened.search(rows[12], k=1, nprobe=4)[0].id == 12
+
+    with pytest.raises(ValueError):
+        DesignIndex(str(tmp_path), DIM + 1)
+
+
+def test_reopen_discards_partially_written_row(tmp_path):
+    index = DesignIndex(str(tmp_path), DIM)
+    rows = clustered_rows(5)
+    index.add_batch(rows[:4], [{'i': i} for i in range(4)], [f'key-{i}' for i in range(4)])
+
+    # Crash after the payload, offset and key of row 4 but mid-way through its vector
+    with open(tmp_path / PAYLOADS_FILE, 'ab') as f:
+        f.write(b'{"i":4}\n')
+    with open(tmp_path / OFFSETS_FILE, 'ab') as f:
+        f.write(np.uint64(0).tobytes())
+    with open(tmp_path / KEYS_FILE, 'ab') as f:
+        f.write(b'key-4\n')
+    with open(tmp_path / VECTORS_FILE, 'ab') as f:
+        f.write(rows[4].tobytes()[:DIM])
+
+    reopened = DesignIndex(str(tmp_path), DIM)
+    assert len(reopened) == 4
+    assert os.path.getsize(tmp_path / VECTORS_FILE) == 4 * 4 * DIM
+    assert os.path.getsize(tmp_path / OFFSETS_FILE) == 4 * 8
+    assert reopened.find('key-4') is None
+
+    # The next row lands cleanly after the surviving ones
+    assert reopened.add(rows[4], {'i': 'new'}, key='key-4') == 4
+    again = DesignIndex(str(tmp_path), DIM)
+    assert len(again) == 5
+    assert again.find('key-4') == 4
+    assert again.payload(4) == {'i': 'new'}
+    assert again.payload(3) == {'i': 3}
+
+
+def test_duplicate_keys_are_not_appended(tmp_path):
+    index = DesignIndex(str(tmp_path), DIM)
+    rows = clustered_rows(3)
+    assert index.add(rows[0], {'i': 0}, key='a') == 0
+    assert index.add(rows[1], {'i': 1}, key='a') == 0
+    assert index.add_batch(rows, [{'i': i} for i in range(3)], ['b', 'b', None]) == [1, 1, 2]
+    assert len(index) == 3
+    assert index.payload(index.find('b')) == {'i': 0}
+
+    with pytest.raises(ValueError):
+        index.add(rows[0], {}, key='bad\nkey')
+
+
+def test_ivf_search_matches_exact_search(tmp_path):
+    index = DesignIndex(str(tmp_path), DIM)
+    rows = clustered_rows(400)
+    index.add_batch(rows, [{'i': i} for i in range(400)])
+    index.build_ivf(nlist=8)
+
+    rng = np.random.default_rng(1)
+    queries = rows[::40] + 0.05 * rng.standard_normal((10, DIM)).astype(np.float32)
+    for query in queries:
+        exact = [m.id for m in index.search(query, k=5)]
+        # Probing every list scores every row, so it must agree with the scan
+        assert [m.id for m in index.search(query, k=5, nprobe=8)] == exact
+        # A partial probe still finds the nearest row on clustered data
+        assert index.search(query, k=1, nprobe=2)[0].id == exact[0]
+
+
+def test_rows_added_after_build_ivf_are_searched(tmp_path):
+    index = DesignIndex(str(tmp_path), DIM)
+    rows = clustered_rows(200)
+    index.add_batch(rows, [{'i': i} for i in range(200)])
+    index.build_ivf(nlist=8)
+
+    new_row = np.random.default_rng(5).standard_normal(DIM).astype(np.float32)
+    (row_id,) = index.add_batch(new_row[None, :], [{'i': 'late'}])
+    assert index.unindexed() == 1
+
+    match = index.search(new_row, k=1, nprobe=1)[0]
+    assert match.id == row_id
+    assert match.payload == {'i': 'late'}
+
+    index.build_ivf(nlist=8)
+    assert index.unindexed() == 0
+    assert index.search(new_row, k=1, nprobe=8)[0].id == row_id
+
+
+def test_embedding_separates_content_and_settings():
+    def design(text, color):
+        return {'document': {'type': 'FRAME', 'children': [
+            {'type': 'TEXT', 'characters': text, 'fills': [{'color': color}]}
+        ]}}
+
+    def cosine(a, b):
+        return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+    base = embed_figma_design(design('Hello', 'red'))
+    assert cosine(base, embed_figma_design(design('Hello', 'red'))) == pytest.approx(1.0)
+    assert cosine(base, embed_figma_design(design('Bye', 'blue'))) < 0.95
+    assert cosine(base, embed_figma_design(design('Hello', 'red'), settings={'a': 1})) < 0.7
+
+
+def test_embedding_tolerates_malformed_nodes():
+    malformed = {'document': {
+        'children': [None, 5, {'x': 'abc', 'width': float('nan'), 'fills': 3, 'children': None}]
+    }}
+    assert embed_figma_design(malformed).shape == (256,)
+    assert embed_figma_design({'children': None}).shape == (256,)
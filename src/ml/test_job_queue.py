@@ -0,0 +1,167 @@
+import threading
+import time
+
+import pytest
+
+from job_queue import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, QueueFull
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'jobs.sqlite3')
+
+
+def test_jobs_run_by_priority_then_submission_order(db_path):
+    order = []
+    queue = JobQueue(db_path, lambda payload: order.append(payload['n']), num_workers=1)
+    ids = [
+        queue.submit({'n': 0}, priority=0),
+        queue.submit({'n': 1}, priority=5),
+        queue.submit({'n': 2}, priority=0),
+        queue.submit({'n': 3}, priority=5),
+    ]
+    queue.start()
+    try:
+        wait_until(lambda: all(queue.get(i)['status'] == SUCCEEDED for i in ids))
+    finally:
+        queue.close()
+    assert order == [1, 3, 0, 2]
+
+
+def test_result_and_error_are_recorded(db_path):
+    def handler(payload):
+        if payload.get('fail'):
+            raise ValueError('bad design')
+        return {'html': '<div></div>'}
+
+    queue = JobQueue(db_path, handler, num_workers=1)
+    ok, bad = queue.submit({}), queue.submit({'fail': True})
+    queue.start()
+    try:
+        wait_until(lambda: queue.get(ok)['status'] == SUCCEEDED)
+        wait_until(lambda: queue.get(bad)['status'] == FAILED)
+        assert queue.get(ok)['result'] == {'html': '<div></div>'}
+        assert queue.get(bad)['error'] == 'bad design'
+        assert queue.get('missing') is None
+    finally:
+        queue.close()
+
+
+def test_per_tenant_limit_lets_other_tenants_run(db_path):
+    release = threading.Event()
+    lock = threading.Lock()
+    active = {}
+    peak = {}
+
+    def handler(payload):
+        tenant = payload['tenant']
+        with lock:
+            active[tenant] = active.get(tenant, 0) + 1
+            peak[tenant] = max(peak.get(tenant, 0), active[tenant])
+        release.wait(5)
+        with lock:
+            active[tenant] -= 1
+
+    queue = JobQueue(db_path, handler, num_workers=3, per_tenant_limit=1)
+    a_ids = [queue.submit({'tenant': 'a'}, tenant='a', priority=1) for _ in range(3)]
+    b_id = queue.submit({'tenant': 'b'}, tenant='b')
+    queue.start()
+    try:
+        # Tenant a's extra jobs are skipped, so b's lower-priority job starts
+        wait_until(lambda: queue.get(b_id)['status'] == RUNNING)
+        assert queue.running() == 2
+        assert [queue.get(i)['status'] for i in a_ids].count(RUNNING) == 1
+        release.set()
+        wait_until(lambda: all(queue.get(i)['status'] == SUCCEEDED for i in a_ids + [b_id]))
+    finally:
+        release.set()
+        queue.close()
+    assert peak == {'a': 1, 'b': 1}
+
+
+def test_submit_raises_queue_full(db_path):
+    queue = JobQueue(db_path, lambda payload: None, max_queued=2)
+    try:
+        queue.submit({}, tenant='a')
+        queue.submit({}, tenant='b')
+        with pytest.raises(QueueFull):
+            queue.submit({}, tenant='c')
+        assert queue.depth() == 2
+    finally:
+        queue.close()
+
+
+def test_one_tenant_cannot_fill_the_queue(db_path):
+    queue = JobQueue(db_path, lambda payload: None, max_queued=10, per_tenant_queued=2)
+    try:
+        queue.submit({}, tenant='a')
+        queue.submit({}, tenant='a')
+        with pytest.raises(QueueFull):
+            queue.submit({}, tenant='a')
+        queue.submit({}, tenant='b')
+        assert queue.depth() == 3
+    finally:
+        queue.close()
+
+
+def test_purge_removes_only_old_finished_jobs(db_path):
+    queue = JobQueue(db_path, lambda payload: payload, num_workers=1, retention_hours=1)
+    old, recent = queue.submit({'n': 1}), queue.submit({'n': 2})
+    queue.start()
+    try:
+        wait_until(lambda: all(queue.get(i)['status'] == SUCCEEDED for i in (old, recent)))
+        queue.stop()
+        pending = queue.submit({'n': 3})
+        with queue._cond:
+            queue._db.execute(
+                'UPDATE jobs SET finished_at = ? WHERE id = ?', (time.time() - 7200, old)
+            )
+        assert queue.purge() == 1
+        assert queue.get(old) is None
+        assert queue.get(recent)['status'] == SUCCEEDED
+        assert queue.get(pending)['status'] == QUEUED
+        assert queue.purge(older_than=0) == 1
+        assert queue.get(recent) is None
+    finally:
+        queue.close()
+
+
+def test_workers_sweep_expired_jobs(db_path):
+    queue = JobQueue(db_path, lambda payload: None, num_workers=1,
+                     retention_hours=0, sweep_interval=0.01)
+    job_id = queue.submit({})
+    queue.start()
+    try:
+        wait_until(lambda: queue.get(job_id) is None)
+    finally:
+        queue.close()
+
+
+def test_running_jobs_are_requeued_on_restart(db_path):
+    queue = JobQueue(db_path, lambda payload: None)
+    job_id = queue.submit({'n': 1})
+    # Claim without finishing, as if the process died mid-job
+    with queue._cond:
+        assert queue._claim() is not None
+    assert queue.get(job_id)['status'] == RUNNING
+    queue._db.close()
+
+    done = []
+    queue = JobQueue(db_path, lambda payload: done.append(payload['n']), num_workers=1)
+    try:
+        job = queue.get(job_id)
+        assert job['status'] == QUEUED
+        assert job['started_at'] is None
+        queue.start()
+        wait_until(lambda: queue.get(job_id)['status'] == SUCCEEDED)
+    finally:
+        queue.close()
+    assert done == [1]
@@ -0,0 +1,100 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def isolated_registry():
+    registered = list(metrics._registry)
+    enabled = metrics.enabled()
+    yield
+    metrics._registry[:] = registered
+    metrics.set_enabled(enabled)
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram('test_seconds', 'Test latency', ['stage'], buckets=(0.1, 1.0))
+    child = histogram.labels('a')
+    # 0.1 sits in its own bucket: `le` is inclusive
+    for value in (0.05, 0.1, 0.5, 2.0):
+        child.observe(value)
+
+    assert '\n'.join(histogram.render()) == '\n'.join([
+        '# HELP test_seconds Test latency',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{stage="a",le="0.1"} 2',
+        'test_seconds_bucket{stage="a",le="1"} 3',
+        'test_seconds_bucket{stage="a",le="+Inf"} 4',
+        'test_seconds_sum{stage="a"} 2.65',
+        'test_seconds_count{stage="a"} 4',
+    ])
+
+
+def test_label_values_are_escaped():
+    counter = metrics.Counter('test_total', 'Test counter', ['path'])
+    counter.labels('a"b\\c\nd').inc(2)
+
+    assert counter.render()[2] == 'test_total{path="a\\"b\\\\c\\nd"} 2'
+
+
+def test_function_backed_counter_and_gauge_read_at_render_time():
+    state = {'value': 1}
+    counter = metrics.Counter('test_events_total', 'Test events', ['event'])
+    counter.labels('hit').set_function(lambda: state['value'])
+    gauge = metrics.Gauge('test_depth', 'Test depth')
+    gauge.set_function(lambda: state['value'] * 1.5)
+
+    state['value'] = 3
+    assert counter.render()[2] == 'test_events_total{event="hit"} 3'
+    assert gauge.render() == [
+        '# HELP test_depth Test depth',
+        '# TYPE test_depth gauge',
+        'test_depth 4.5',
+    ]
+
+
+def test_gauge_inc_dec_set():
+    gauge = metrics.Gauge('test_in_flight', 'Test gauge')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.render()[2] == 'test_in_flight 1'
+    gauge.set(7)
+    assert gauge.render()[2] == 'test_in_flight 7'
+
+
+def test_labels_require_every_label_name():
+    counter = metrics.Counter('test_labelled_total', 'Test counter', ['a', 'b'])
+    with pytest.raises(ValueError):
+        counter.labels('only-one')
+
+
+def test_render_joins_every_registered_metric():
+    metrics.Counter('test_first_total', 'First').inc()
+    metrics.Counter('test_second_total', 'Second').inc(2)
+
+    text = metrics.render()
+    assert text.endswith('\n')
+    assert 'test_first_total 1\n# HELP test_second_total Second\n' in text
+    assert 'test_second_total 2\n' in text
+
+
+def test_timers_record_only_when_enabled():
+    child = metrics.STAGE_SECONDS.labels('test_stage')
+    before = sum(child.counts)
+
+    @metrics.timed('test_stage')
+    def work():
+        return 'ok'
+
+    metrics.set_enabled(False)
+    assert work() == 'ok'
+    with metrics.stage('test_stage'):
+        pass
+    assert sum(child.counts) == before
+
+    metrics.set_enabled(True)
+    work()
+    with metrics.stage('test_stage'):
+        pass
+    assert sum(child.counts) == before + 2
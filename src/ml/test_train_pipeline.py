@@ -0,0 +1,110 @@
+import os
+import threading
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from train_pipeline import AsyncCheckpointer, BatchPrefetcher, load_checkpoint
+
+CPU = torch.device('cpu')
+
+
+def prefetch_threads():
+    return [t for t in threading.enumerate() if t.name == 'batch-prefetch']
+
+
+def test_prefetcher_yields_every_batch_in_order():
+    loader = [{'x': torch.full((2,), i), 'meta': [i]} for i in range(5)]
+    prefetcher = BatchPrefetcher(loader, CPU, depth=2)
+
+    batches = list(prefetcher)
+    assert len(prefetcher) == 5
+    assert [int(b['x'][0]) for b in batches] == [0, 1, 2, 3, 4]
+    assert [b['meta'] for b in batches] == [[i] for i in range(5)]
+    assert prefetcher.wait_time >= 0
+    assert not prefetch_threads()
+
+
+@pytest.mark.parametrize('error', [RuntimeError, KeyboardInterrupt])
+def test_prefetcher_raises_loader_errors(error):
+    def loader():
+        yield {'x': torch.zeros(1)}
+        raise error('corrupt sample')
+
+    class Loader:
+        def __iter__(self):
+            return loader()
+
+    with pytest.raises(error, match='corrupt sample'):
+        list(BatchPrefetcher(Loader(), CPU))
+    assert not prefetch_threads()
+
+
+def test_stopping_early_joins_the_producer():
+    loader = [torch.full((1,), i) for i in range(100)]
+    for batch in BatchPrefetcher(loader, CPU, depth=2):
+        break
+    assert not prefetch_threads()
+
+
+def test_persistent_worker_loader_survives_an_interrupted_pass():
+    dataset = TensorDataset(torch.arange(32))
+    loader = DataLoader(dataset, batch_size=4, num_workers=1, persistent_workers=True)
+    prefetcher = BatchPrefetcher(loader, CPU, depth=2)
+
+    for batch in prefetcher:
+        break
+    values = torch.cat([batch[0] for batch in prefetcher])
+    assert values.tolist() == list(range(32))
+
+
+def test_checkpointer_writes_a_copy_taken_at_save_time(tmp_path):
+    path = str(tmp_path / 'state.pth')
+    weight = torch.ones(3)
+    checkpointer = AsyncCheckpointer()
+    checkpointer.save({'weight': weight, 'step': 1}, path)
+    weight.add_(1)
+    checkpointer.close()
+
+    state = torch.load(path)
+    assert state['step'] == 1
+    assert state['weight'].tolist() == [1.0, 1.0, 1.0]
+    assert os.listdir(tmp_path) == ['state.pth']
+
+
+def test_checkpointer_reports_write_errors(tmp_path):
+    checkpointer = AsyncCheckpointer()
+    checkpointer.save({'step': 1}, str(tmp_path / 'missing' / 'state.pth'))
+    # torch.save reports a missing directory as RuntimeError
+    with pytest.raises((OSError, RuntimeError)):
+        checkpointer.wait()
+    checkpointer.save({'step': 2}, str(tmp_path / 'state.pth'))
+    checkpointer.close()
+    assert torch.load(str(tmp_path / 'state.pth')) == {'step': 2}
+
+
+def test_load_checkpoint_restores_model_and_optimizer(tmp_path):
+    torch.manual_seed(0)
+    model = torch.nn.Linear(4, 2)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    model(torch.randn(8, 4)).sum().backward()
+    optimizer.step()
+
+    path = str(tmp_path / 'checkpoint.pth')
+    checkpointer = AsyncCheckpointer()
+    checkpointer.save({
+        'epoch': 3,
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'best_val_loss': 0.5,
+    }, path)
+    checkpointer.close()
+
+    restored = torch.nn.Linear(4, 2)
+    restored_optimizer = torch.optim.Adam(restored.parameters(), lr=0.01)
+    assert load_checkpoint(path, restored, restored_optimizer, CPU) == (4, 0.5)
+    assert torch.equal(restored.weight, model.weight)
+    saved_state = optimizer.state_dict()['state']
+    restored_state = restored_optimizer.state_dict()['state']
+    assert torch.equal(restored_state[0]['exp_avg'], saved_state[0]['exp_avg'])
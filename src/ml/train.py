@@ -1,12 +1,18 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
-from model import DesignToCode
+from model import DesignToCode, STUDENT_ENCODERS, build_student_encoder
+from image_pipeline import load_image_tensor
+from profiling import ProfileStore, StepProfiler
+from train_pipeline import AsyncCheckpointer, BatchPrefetcher, load_checkpoint
+import copy
 import json
 import os
+import statistics
+import time
 from PIL import Image
-import torchvision.transforms as transforms
 from typing import List, Dict, Any
 import logging
 import argparse
@@ -18,12 +24,8 @@ logger = logging.getLogger(__name__)
 class DesignDataset(Dataset):
     def __init__(self, data_dir: str, transform=None):
         self.data_dir = data_dir
-        self.transform = transform or transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], 
-                               std=[0.229, 0.224, 0.225])
-        ])
+        # Without a custom transform, images go through the fused decode pipeline
+        self.transform = transform
         
         self.samples = []
         self.load_dataset()
@@ -32,7 +34,8 @@ class DesignDataset(Dataset):
         """Load dataset from the data directory"""
         logger.info("Loading dataset...")
         
-        for sample_dir in os.listdir(self.data_dir):
+        # Sorted so a seeded split selects the same samples on every run
+        for sample_dir in sorted(os.listdir(self.data_dir)):
             sample_path = os.path.join(self.data_dir, sample_dir)
             if os.path.isdir(sample_path):
                 try:
@@ -64,9 +67,10 @@ class DesignDataset(Dataset):
         sample = self.samples[idx]
         
         # Load and transform image
-        image = Image.open(sample['image_path']).convert('RGB')
         if self.transform:
-            image = self.transform(image)
+            image = self.transform(Image.open(sample['image_path']).convert('RGB'))
+        else:
+            image = load_image_tensor(sample['image_path'])
             
         return {
             'image': image,
@@ -74,88 +78,282 @@ class DesignDataset(Dataset):
             'css': sample['css']
         }
 
+def code_loss(model: DesignToCode, batch: Dict[str, torch.Tensor], criterion: nn.Module):
+    """HTML plus CSS token loss for a batch already on the model's device, and the outputs"""
+    html_tokens = batch['html_tokens']
+    css_tokens = batch['css_tokens']
+    outputs = model(batch['image'], html_tokens, css_tokens)
+    html_loss = criterion(
+        outputs['html_output'].view(-1, model.html_decoder.output.out_features),
+        html_tokens.view(-1)
+    )
+    css_loss = criterion(
+        outputs['css_output'].view(-1, model.css_decoder.output.out_features),
+        css_tokens.view(-1)
+    )
+    return html_loss + css_loss, outputs
+
+def train_step(
+    model: DesignToCode,
+    batch: Dict[str, torch.Tensor],
+    criterion: nn.Module,
+    optimizer: optim.Optimizer
+) -> float:
+    """One optimizer step on a batch already on the model's device, returning the loss"""
+    optimizer.zero_grad()
+    loss, _ = code_loss(model, batch, criterion)
+    loss.backward()
+    optimizer.step()
+    return loss.item()
+
 def train_model(
     model: nn.Module,
     train_loader: DataLoader,
     val_loader: DataLoader,
     num_epochs: int,
     device: torch.device,
-    save_dir: str
+    save_dir: str,
+    profiler: StepProfiler = None,
+    prefetch_depth: int = 2,
+    resume: bool = False
 ):
     """Train the model"""
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.Adam(model.parameters(), lr=0.001)
     
     best_val_loss = float('inf')
+    start_epoch = 0
     
-    for epoch in range(num_epochs):
-        logger.info(f"Epoch {epoch+1}/{num_epochs}")
-        
-        # Training phase
-        model.train()
-        train_loss = 0.0
-        train_batches = tqdm(train_loader, desc="Training")
-        
-        for batch in train_batches:
-            images = batch['image'].to(device)
-            html_tokens = batch['html_tokens'].to(device)
-            css_tokens = batch['css_tokens'].to(device)
+    # Latest full training state, rewritten every epoch for --resume
+    checkpoint_path = os.path.join(save_dir, 'checkpoint.pth')
+    if resume and os.path.exists(checkpoint_path):
+        start_epoch, best_val_loss = load_checkpoint(checkpoint_path, model, optimizer, device)
+        logger.info(f"Resumed from {checkpoint_path} at epoch {start_epoch+1}")
+    
+    checkpointer = AsyncCheckpointer()
+    train_prefetcher = BatchPrefetcher(train_loader, device, prefetch_depth)
+    val_prefetcher = BatchPrefetcher(val_loader, device, prefetch_depth)
+    
+    # Closing flushes queued checkpoint writes even when training is
+    # interrupted; the writer is a daemon thread and would drop them
+    try:
+        for epoch in range(start_epoch, num_epochs):
+            logger.info(f"Epoch {epoch+1}/{num_epochs}")
+            epoch_start = time.perf_counter()
+            
+            # Training phase
+            model.train()
+            train_loss = 0.0
+            train_batches = tqdm(train_prefetcher, desc="Training")
             
-            optimizer.zero_grad()
+            # The prefetcher has already moved each batch to `device`
+            for batch in train_batches:
+                loss = train_step(model, batch, criterion, optimizer)
+                
+                train_loss += loss
+                train_batches.set_postfix({'loss': loss})
+                
+                if profiler:
+                    profiler.step()
+                
+            avg_train_loss = train_loss / len(train_loader)
             
-            outputs = model(images, html_tokens, css_tokens)
+            # Validation phase
+            model.eval()
+            val_loss = 0.0
             
-            # Calculate loss
-            html_loss = criterion(
-                outputs['html_output'].view(-1, model.html_decoder.output.out_features),
-                html_tokens.view(-1)
-            )
-            css_loss = criterion(
-                outputs['css_output'].view(-1, model.css_decoder.output.out_features),
-                css_tokens.view(-1)
-            )
+            with torch.no_grad():
+                for batch in tqdm(val_prefetcher, desc="Validation"):
+                    loss, _ = code_loss(model, batch, criterion)
+                    val_loss += loss.item()
+                    
+            avg_val_loss = val_loss / len(val_loader)
             
-            loss = html_loss + css_loss
-            loss.backward()
-            optimizer.step()
+            logger.info(f"Train Loss: {avg_train_loss:.4f}, Val Loss: {avg_val_loss:.4f}")
             
-            train_loss += loss.item()
-            train_batches.set_postfix({'loss': loss.item()})
+            epoch_time = time.perf_counter() - epoch_start
+            data_wait = train_prefetcher.wait_time + val_prefetcher.wait_time
+            logger.info(f"Data wait: {data_wait:.1f}s of {epoch_time:.1f}s ({data_wait / epoch_time:.1%})")
             
-        avg_train_loss = train_loss / len(train_loader)
+            # Save best model
+            if avg_val_loss < best_val_loss:
+                best_val_loss = avg_val_loss
+                checkpointer.save(model.state_dict(), os.path.join(save_dir, 'best_model.pth'))
+                logger.info("Saved best model")
+            
+            checkpointer.save({
+                'epoch': epoch,
+                'model': model.state_dict(),
+                'optimizer': optimizer.state_dict(),
+                'best_val_loss': best_val_loss
+            }, checkpoint_path)
+    finally:
+        checkpointer.close()
+        if profiler:
+            profiler.close()
+
+def feature_loss(student_features: torch.Tensor, teacher_features: torch.Tensor) -> torch.Tensor:
+    """MSE plus cosine distance between student and teacher design features"""
+    mse = F.mse_loss(student_features, teacher_features)
+    cosine = F.cosine_similarity(student_features, teacher_features, dim=1).mean()
+    return mse + (1 - cosine)
+
+def distill_encoder(
+    teacher: DesignToCode,
+    student: nn.Module,
+    student_name: str,
+    train_loader: DataLoader,
+    val_loader: DataLoader,
+    num_epochs: int,
+    device: torch.device,
+    save_dir: str,
+    joint: bool = False,
+    code_weight: float = 1.0,
+    profiler: StepProfiler = None
+) -> nn.Module:
+    """
+    Train `student` to reproduce the teacher's design_features. With `joint`,
+    the teacher's decoders are copied on top of the student and fine-tuned
+    together with it on the code loss as well.
+    """
+    teacher.eval()
+    for param in teacher.parameters():
+        param.requires_grad_(False)
+    
+    if joint:
+        model = copy.deepcopy(teacher)
+        model.encoder = student
+        for param in model.parameters():
+            param.requires_grad_(True)
+    else:
+        model = student
+    model.to(device)
+    
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=0.001)
+    
+    def step_loss(batch):
+        images = batch['image'].to(device)
+        with torch.no_grad():
+            teacher_features = teacher.encoder(images)
         
-        # Validation phase
-        model.eval()
-        val_loss = 0.0
+        if not joint:
+            return feature_loss(model(images), teacher_features)
         
-        with torch.no_grad():
-            for batch in tqdm(val_loader, desc="Validation"):
-                images = batch['image'].to(device)
-                html_tokens = batch['html_tokens'].to(device)
-                css_tokens = batch['css_tokens'].to(device)
-                
-                outputs = model(images, html_tokens, css_tokens)
-                
-                html_loss = criterion(
-                    outputs['html_output'].view(-1, model.html_decoder.output.out_features),
-                    html_tokens.view(-1)
-                )
-                css_loss = criterion(
-                    outputs['css_output'].view(-1, model.css_decoder.output.out_features),
-                    css_tokens.view(-1)
-                )
+        if 'html_tokens' not in batch or 'css_tokens' not in batch:
+            raise ValueError(
+                "Joint distillation needs batches with 'html_tokens' and 'css_tokens'"
+            )
+        loss, outputs = code_loss(model, {
+            'image': images,
+            'html_tokens': batch['html_tokens'].to(device),
+            'css_tokens': batch['css_tokens'].to(device),
+        }, criterion)
+        return feature_loss(outputs['design_features'], teacher_features) + code_weight * loss
+    
+    best_val_loss = float('inf')
+    
+    try:
+        for epoch in range(num_epochs):
+            logger.info(f"Distill epoch {epoch+1}/{num_epochs}")
+            
+            model.train()
+            train_loss = 0.0
+            train_batches = tqdm(train_loader, desc="Distilling")
+            
+            for batch in train_batches:
+                optimizer.zero_grad()
+                loss = step_loss(batch)
+                loss.backward()
+                optimizer.step()
                 
-                val_loss += (html_loss + css_loss).item()
+                train_loss += loss.item()
+                train_batches.set_postfix({'loss': loss.item()})
                 
-        avg_val_loss = val_loss / len(val_loader)
-        
-        logger.info(f"Train Loss: {avg_train_loss:.4f}, Val Loss: {avg_val_loss:.4f}")
+                if profiler:
+                    profiler.step()
+                    
+            avg_train_loss = train_loss / len(train_loader)
+            
+            model.eval()
+            val_loss = 0.0
+            
+            with torch.no_grad():
+                for batch in tqdm(val_loader, desc="Validation"):
+                    val_loss += step_loss(batch).item()
+                    
+            avg_val_loss = val_loss / len(val_loader)
+            
+            logger.info(f"Train Loss: {avg_train_loss:.4f}, Val Loss: {avg_val_loss:.4f}")
+            
+            if avg_val_loss < best_val_loss:
+                best_val_loss = avg_val_loss
+                torch.save(student.state_dict(), os.path.join(save_dir, f'student_{student_name}.pth'))
+                if joint:
+                    torch.save(model.state_dict(), os.path.join(save_dir, f'distilled_{student_name}.pth'))
+                logger.info("Saved best student")
+    finally:
+        if profiler:
+            profiler.close()
+    
+    return student
+
+def evaluate_encoder(
+    encoder: nn.Module,
+    teacher: DesignToCode,
+    val_loader: DataLoader,
+    device: torch.device,
+    latency_runs: int = 20
+) -> Dict[str, Any]:
+    """
+    Measure how closely `encoder` matches the teacher's features on the
+    validation set, and its single-image CPU latency.
+    """
+    encoder.eval()
+    teacher.eval()
+    cosine_total, mse_total, count = 0.0, 0.0, 0
+    
+    with torch.no_grad():
+        for batch in val_loader:
+            images = batch['image'].to(device)
+            teacher_features = teacher.encoder(images)
+            features = encoder(images)
+            cosine_total += F.cosine_similarity(features, teacher_features, dim=1).sum().item()
+            mse_total += F.mse_loss(features, teacher_features, reduction='sum').item() / features.size(1)
+            count += images.size(0)
         
-        # Save best model
-        if avg_val_loss < best_val_loss:
-            best_val_loss = avg_val_loss
-            torch.save(model.state_dict(), os.path.join(save_dir, 'best_model.pth'))
-            logger.info("Saved best model")
+        # Serving nodes are CPU-only, so latency is always measured there
+        cpu_encoder = copy.deepcopy(encoder).cpu()
+        image = torch.randn(1, 3, 224, 224)
+        cpu_encoder(image)
+        timings = []
+        for _ in range(latency_runs):
+            start = time.perf_counter()
+            cpu_encoder(image)
+            timings.append((time.perf_counter() - start) * 1000)
+    
+    return {
+        'params': sum(p.numel() for p in encoder.parameters()),
+        'latency_ms': statistics.median(timings),
+        'cosine_similarity': cosine_total / max(count, 1),
+        'feature_mse': mse_total / max(count, 1),
+    }
+
+def update_student_report(save_dir: str, entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Add or replace an entry (by name) in save_dir/students.json"""
+    report_path = os.path.join(save_dir, 'students.json')
+    report = []
+    if os.path.exists(report_path):
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+    report = [e for e in report if e['name'] != entry['name']] + [entry]
+    report.sort(key=lambda e: e['latency_ms'])
+    
+    tmp_path = report_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, report_path)
+    return report
 
 def main():
     parser = argparse.ArgumentParser(description='Train Design to Code model')
@@ -163,6 +361,19 @@ def main():
     parser.add_argument('--save-dir', type=str, default='checkpoints', help='Directory to save model checkpoints')
     parser.add_argument('--epochs', type=int, default=100, help='Number of epochs to train')
     parser.add_argument('--batch-size', type=int, default=32, help='Batch size')
+    parser.add_argument('--profile-steps', type=int, default=0, help='Number of training steps to profile')
+    parser.add_argument('--profile-skip', type=int, default=10, help='Training steps to run before profiling')
+    parser.add_argument('--profile-dir', type=str, default='profiles', help='Directory for profiler traces')
+    parser.add_argument('--distill', type=str, choices=sorted(STUDENT_ENCODERS), help='Distill the encoder into this student instead of training')
+    parser.add_argument('--teacher-checkpoint', type=str, help='DesignToCode weights to distill from')
+    parser.add_argument('--distill-joint', action='store_true', help='Fine-tune the decoders together with the student (needs a tokenized dataset)')
+    parser.add_argument('--code-weight', type=float, default=1.0, help='Weight of the code loss in joint distillation')
+    parser.add_argument('--student-pretrained', action='store_true', help='Start MobileNet students from ImageNet weights')
+    parser.add_argument('--num-workers', type=int, default=min(4, os.cpu_count() or 1), help='DataLoader worker processes')
+    parser.add_argument('--prefetch-factor', type=int, default=2, help='Batches each worker loads ahead')
+    parser.add_argument('--prefetch-depth', type=int, default=2, help='Batches kept ready for the training step')
+    parser.add_argument('--resume', action='store_true', help='Resume from the latest checkpoint in --save-dir')
+    parser.add_argument('--split-seed', type=int, default=0, help='Seed of the train/validation split; keep it when resuming')
     args = parser.parse_args()
     
     # Create save directory if it doesn't exist
@@ -174,19 +385,94 @@ def main():
     
     # Create dataset and dataloaders
     dataset = DesignDataset(args.data_dir)
+    if args.distill_joint and len(dataset) > 0 and 'html_tokens' not in dataset[0]:
+        parser.error("--distill-joint needs tokenized html/css, which DesignDataset does not provide yet")
     train_size = int(0.8 * len(dataset))
     val_size = len(dataset) - train_size
-    train_dataset, val_dataset = torch.utils.data.random_split(dataset, [train_size, val_size])
+    # Seeded so a resumed run validates on the same samples it did before
+    train_dataset, val_dataset = torch.utils.data.random_split(
+        dataset, [train_size, val_size],
+        generator=torch.Generator().manual_seed(args.split_seed)
+    )
     
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=args.batch_size)
+    # Workers hand batches back through shared memory; pinned memory lets
+    # the copy to the GPU run asynchronously
+    loader_options = {
+        'batch_size': args.batch_size,
+        'num_workers': args.num_workers,
+        'pin_memory': device.type == 'cuda',
+    }
+    if args.num_workers > 0:
+        loader_options['persistent_workers'] = True
+        loader_options['prefetch_factor'] = args.prefetch_factor
+    train_loader = DataLoader(train_dataset, shuffle=True, **loader_options)
+    val_loader = DataLoader(val_dataset, **loader_options)
     
     # Initialize model
     model = DesignToCode(
         html_vocab_size=1000,  # Update with actual vocabulary sizes
-        css_vocab_size=1000
+        css_vocab_size=1000,
+        # ImageNet weights would be overwritten by the teacher checkpoint anyway
+        pretrained=not (args.distill and args.teacher_checkpoint)
     ).to(device)
     
+    profiler = None
+    if args.profile_steps:
+        profiler = StepProfiler(
+            ProfileStore(args.profile_dir),
+            num_steps=args.profile_steps,
+            skip_steps=args.profile_skip
+        )
+    
+    if args.distill:
+        if args.teacher_checkpoint:
+            model.load_state_dict(torch.load(args.teacher_checkpoint, map_location=device))
+        else:
+            logger.warning("No --teacher-checkpoint given; distilling from the untrained teacher")
+        
+        student = build_student_encoder(args.distill, pretrained=args.student_pretrained).to(device)
+        distill_encoder(
+            teacher=model,
+            student=student,
+            student_name=args.distill,
+            train_loader=train_loader,
+            val_loader=val_loader,
+            num_epochs=args.epochs,
+            device=device,
+            save_dir=args.save_dir,
+            joint=args.distill_joint,
+            code_weight=args.code_weight,
+            profiler=profiler
+        )
+        
+        # Reload the best checkpoint so the report describes what was saved
+        student.load_state_dict(torch.load(
+            os.path.join(args.save_dir, f'student_{args.distill}.pth'), map_location=device
+        ))
+        update_student_report(args.save_dir, {
+            'name': 'teacher',
+            'role': 'teacher',
+            'checkpoint': args.teacher_checkpoint,
+            'embed_dim': model.encoder.design_layers[-1].out_features,
+            **evaluate_encoder(model.encoder, model, val_loader, device)
+        })
+        report = update_student_report(args.save_dir, {
+            'name': args.distill,
+            'role': 'student',
+            'checkpoint': f'student_{args.distill}.pth',
+            'embed_dim': student.design_layers[-1].out_features,
+            'joint': args.distill_joint,
+            **evaluate_encoder(student, model, val_loader, device)
+        })
+        
+        logger.info("Latency/accuracy trade-off (students.json):")
+        for entry in report:
+            logger.info(
+                f"  {entry['name']:<20} {entry['latency_ms']:8.1f} ms  "
+                f"cosine {entry['cosine_similarity']:.4f}  params {entry['params'] / 1e6:.1f}M"
+            )
+        return
+    
     # Train model
     train_model(
         model=model,
@@ -194,7 +480,10 @@ def main():
         val_loader=val_loader,
         num_epochs=args.epochs,
         device=device,
-        save_dir=args.save_dir
+        save_dir=args.save_dir,
+        profiler=profiler,
+        prefetch_depth=args.prefetch_depth,
+        resume=args.resume
     )
 
 if __name__ == '__main__':
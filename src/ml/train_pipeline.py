@@ -0,0 +1,169 @@
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import torch
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def move_to_device(batch: Any, device: torch.device) -> Any:
+    """Move every tensor in a (nested) batch to `device` without blocking on pinned memory"""
+    if isinstance(batch, torch.Tensor):
+        return batch.to(device, non_blocking=True)
+    if isinstance(batch, dict):
+        return {key: move_to_device(value, device) for key, value in batch.items()}
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(move_to_device(value, device) for value in batch)
+    return batch
+
+
+class BatchPrefetcher:
+    """
+    Iterates a DataLoader from a background thread, keeping up to `depth`
+    batches ready so the next batch loads while the current step runs.
+
+    `wait_time` is the time the consumer spent blocked waiting for input
+    during the last pass, for computing the data-wait fraction of an epoch.
+
+    When the consumer stops early, the producer finishes the batch it is
+    loading and exits before the pass returns, so the next pass never
+    shares a (persistent-worker) DataLoader iterator with a stale thread.
+    """
+
+    def __init__(self, loader: Iterable, device: torch.device, depth: int = 2):
+        self.loader = loader
+        self.device = device
+        self.depth = max(1, depth)
+        self.wait_time = 0.0
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def __iter__(self):
+        ready: queue.Queue = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            iterator = None
+            try:
+                iterator = iter(self.loader)
+                while not stop.is_set():
+                    try:
+                        batch = next(iterator)
+                    except StopIteration:
+                        put(_END)
+                        return
+                    if not put(batch):
+                        return
+            except BaseException as e:
+                # Anything escaping here would leave the consumer waiting forever
+                put(_Failure(e))
+            finally:
+                # Shuts down the workers of a non-persistent multi-process iterator
+                del iterator
+
+        producer = threading.Thread(target=produce, name='batch-prefetch', daemon=True)
+        producer.start()
+        self.wait_time = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                item = ready.get()
+                self.wait_time += time.perf_counter() - start
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield move_to_device(item, self.device)
+        finally:
+            stop.set()
+            producer.join()
+
+
+def _cpu_copy(state: Any) -> Any:
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {key: _cpu_copy(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_cpu_copy(value) for value in state)
+    return state
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints on a background thread. The state is copied to CPU
+    when save() is called so training can keep updating the parameters, and
+    each file is written to a temporary path and renamed into place, so a
+    crash mid-write never leaves a truncated checkpoint behind.
+    """
+
+    def __init__(self):
+        self._pending: queue.Queue = queue.Queue()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._write, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+
+    def _write(self):
+        while True:
+            item = self._pending.get()
+            try:
+                if item is None:
+                    return
+                state, path = item
+                tmp_path = path + '.tmp'
+                torch.save(state, tmp_path)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._pending.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def save(self, state: Dict[str, Any], path: str):
+        self._raise_error()
+        self._pending.put((_cpu_copy(state), path))
+
+    def wait(self):
+        """Block until every queued checkpoint is on disk"""
+        self._pending.join()
+        self._raise_error()
+
+    def close(self):
+        self.wait()
+        self._pending.put(None)
+        self._thread.join()
+
+
+def load_checkpoint(
+    path: str,
+    model: torch.nn.Module,
+    optimizer: torch.optim.Optimizer,
+    device: torch.device
+) -> Tuple[int, float]:
+    """Restore model and optimizer state, returning (next epoch, best val loss)"""
+    checkpoint = torch.load(path, map_location=device)
+    model.load_state_dict(checkpoint['model'])
+    optimizer.load_state_dict(checkpoint['optimizer'])
+    return checkpoint['epoch'] + 1, checkpoint['best_val_loss']